@@ -27,14 +27,26 @@ from __future__ import division
 
 import collections
 from datetime import datetime
+import json
 import logging
+from multiprocessing.pool import ThreadPool
 import os
+import random
 
+import numpy
 from numpy import nan
 import pandas
 
 from openfisca_france_data import AGGREGATES_DEFAULT_VARS, FILTERING_VARS, PLUGINS_DIR
 
+from .calibration import calibrate_weights
+from .memory import MemoryManager
+from .overlaps import BeneficiaryMasks
+from .reducers import get_default_reducer_by_name, reduce_values
+from .reform_delta import get_affected_variables
+from .sampling import (estimate_total, get_expansions, get_stratified_sample, select_sampled_rows,
+    subsample_input_data_frame)
+
 
 log = logging.getLogger(__name__)
 
@@ -46,7 +58,15 @@ DATA_DIR = os.path.join(PLUGINS_DIR, 'aggregates')
 
 class Aggregates(object):
     base_data_frame = None
+    beneficiary_masks_by_simulation_type = None
+    calibration_diagnostics = None
     filter_by = None
+    keep_beneficiary_masks = False  # Keep bit-packed beneficiary masks to compute overlaps of beneficiaries
+    memory_budget = None  # Maximal number of bytes held by the simulations while aggregating, None for no limit
+    memory_usage_by_phase = None
+    monthly = False  # Add the monthly statistics (amounts and beneficiaries by default) to the annual ones
+    pipeline_queue_size = 4  # Maximal number of variables waiting for their reduction in the pipeline
+    pipeline_workers = 0  # Number of threads reducing the arrays while the simulation runs, 0 for serial aggregation
     labels = collections.OrderedDict((
         ('var', u"Mesure"),
         ('entity', u"Entité"),
@@ -61,11 +81,17 @@ class Aggregates(object):
         ('dep_diff_rel', u"Diff. relative\nDépenses"),
         ('benef_diff_rel', u"Diff. relative\nBénéficiaires"),
         ))  # TODO: localize
+    preview_data_frame = None
+    reducer_by_name = None  # Statistics computed for each variable, amount and beneficiaries by default
+    reduction_chunk_size = None  # Number of entities reduced at once, None for all of them
     reference_simulation = None
     reform_simulation = None
+    reuse_unaffected_aggregates = False  # Use the reference aggregates of the variables unaffected by the reform
     survey_scenario = None
     totals_df = None
+    unaffected_check_count = 2  # Number of unaffected variables computed anyway to check their reform values
     varlist = None
+    weight_by_entity_key_plural = None  # Calibrated weights overriding the survey weights
 
     def __init__(self, survey_scenario = None, debug = False, debug_all = False, trace = False):
         assert survey_scenario is not None
@@ -92,12 +118,100 @@ class Aggregates(object):
 
         self.varlist = AGGREGATES_DEFAULT_VARS
         self.filter_by = FILTERING_VARS[0]
+        self.beneficiary_masks_by_simulation_type = dict()
+        self.reducer_by_name = get_default_reducer_by_name()
+        self.weight_by_entity_key_plural = dict()
+
+    def calibrate_weights(self, method = 'raking', simulation_type = 'reference', amount = True,
+            beneficiaries = True, keep_population = True, max_iterations = 50, tolerance = 1e-6):
+        """
+        Calibrates the entity weights on the actual amounts and beneficiaries
+
+        The calibrated weights are stored in weight_by_entity_key_plural and used by the following calls to
+        compute_variable_aggregates. The weights of an entity whose calibration doesn't converge are left unchanged.
+        Returns the convergence diagnostics by entity.
+
+        Parameters
+        ----------
+        method : string
+                 linear or raking
+        simulation_type : string
+                          reference or reform, simulation providing the margins
+        amount : bool
+                 use the actual amounts as margins
+        beneficiaries : bool
+                        use the actual numbers of beneficiaries as margins
+        keep_population : bool
+                          add a margin keeping the total weight of each entity unchanged
+        """
+        assert amount or beneficiaries
+        assert simulation_type in ['reference', 'reform']
+        if self.totals_df is None:
+            self.load_amounts_from_file()
+        if self.totals_df is None or self.totals_df.empty:
+            log.info("No administrative data available for year {}: weights are not calibrated".format(self.year))
+            return dict()
+
+        simulation = getattr(self, '{}_simulation'.format(simulation_type))
+        column_by_name = simulation.tax_benefit_system.column_by_name
+        variables_by_entity_key_plural = collections.OrderedDict()
+        for variable in self.varlist:
+            if variable not in column_by_name or variable not in self.totals_df.index:
+                continue
+            entity_key_plural = column_by_name[variable].entity_key_plural
+            variables_by_entity_key_plural.setdefault(entity_key_plural, list()).append(variable)
+
+        diagnostics_by_entity_key_plural = dict()
+        for entity_key_plural, variables in variables_by_entity_key_plural.iteritems():
+            initial_weights = simulation.calculate(self.weight_column_name_by_entity_key_plural[entity_key_plural])
+            if self.filter_by:
+                filter_dummy = simulation.calculate("{}_{}".format(self.filter_by, entity_key_plural))
+            else:
+                filter_dummy = 1
+            margins = list()
+            targets = list()
+            for variable in variables:
+                values = simulation.calculate_add(variable)
+                actual_amount = self.totals_df.get_value(variable, 'actual_amount')
+                if amount and numpy.isfinite(actual_amount):
+                    margins.append(values * filter_dummy)
+                    targets.append(actual_amount * 10 ** 6)
+                actual_beneficiaries = self.totals_df.get_value(variable, 'actual_beneficiaries')
+                if beneficiaries and numpy.isfinite(actual_beneficiaries):
+                    margins.append((values != 0) * filter_dummy)
+                    targets.append(actual_beneficiaries * 10 ** 3)
+            if not margins:
+                continue
+            if keep_population:
+                margins.append(numpy.ones(len(initial_weights)))
+                targets.append(initial_weights.sum())
+
+            weights, diagnostics = calibrate_weights(
+                numpy.column_stack(margins),
+                initial_weights,
+                targets,
+                method = method,
+                max_iterations = max_iterations,
+                tolerance = tolerance,
+                )
+            diagnostics_by_entity_key_plural[entity_key_plural] = diagnostics
+            if not diagnostics['converged']:
+                log.warning("Calibration of {} weights did not converge: weights are not calibrated ({})".format(
+                    entity_key_plural, diagnostics))
+                continue
+            log.info("Calibration of {} weights: {}".format(entity_key_plural, diagnostics))
+            self.weight_by_entity_key_plural[entity_key_plural] = weights
+
+        self.calibration_diagnostics = diagnostics_by_entity_key_plural
+        # Aggregates and beneficiary masks computed with the former weights are outdated
+        self.base_data_frame = None
+        self.beneficiary_masks_by_simulation_type = dict()
+        return diagnostics_by_entity_key_plural
 
     def compute_aggregates(self, reference = True, reform = True, actual = True):
         """
         Compute aggregate amounts
         """
-        filter_by = self.filter_by
         self.load_amounts_from_file()
 
         simulation_types = list()
@@ -108,7 +222,7 @@ class Aggregates(object):
         if actual:
             simulation_types.append('actual')
 
-        no_reform = self.survey_scenario.reference_tax_benefit_system is None
+        no_reform = self.reform_simulation is self.reference_simulation
 
         data_frame_by_simulation_type = dict()
 
@@ -124,12 +238,8 @@ class Aggregates(object):
                         ))
                     continue
 
-                data_frame = pandas.DataFrame()
-                for variable in self.varlist:
-                    variable_data_frame = self.compute_variable_aggregates(
-                        variable, filter_by = filter_by, simulation_type = simulation_type)
-                    data_frame = pandas.concat((data_frame, variable_data_frame))
-                data_frame_by_simulation_type[simulation_type] = data_frame.copy()
+                data_frame_by_simulation_type[simulation_type] = self.compute_simulation_aggregates(
+                    simulation_type, reference_data_frame = data_frame_by_simulation_type.get('reference'))
 
         if reference and reform:
             del data_frame_by_simulation_type['reform']['entity']
@@ -138,6 +248,27 @@ class Aggregates(object):
         self.base_data_frame = pandas.concat(data_frame_by_simulation_type.values(), axis = 1).loc[self.varlist]
         return self.base_data_frame
 
+    def compute_combination_beneficiaries(self, include, exclude = None, simulation_type = 'reference'):
+        """
+        Returns the number of beneficiaries (in thousands) of all the included variables and none of the excluded ones
+
+        The variables must be of the same entity and their beneficiary masks must have been kept (see
+        keep_beneficiary_masks). Each element of include and exclude is a variable name or a list of variable names
+        meaning any of them, e.g. include = ['rsa', ['apl', 'alf', 'als']].
+        """
+        variables = [
+            variable
+            for variables in list(include) + list(exclude or list())
+            for variable in ([variables] if isinstance(variables, basestring) else variables)
+            ]
+        entity_key_plurals = set(
+            self.get_beneficiary_masks_entity_key_plural(variable, simulation_type)
+            for variable in variables
+            )
+        assert len(entity_key_plurals) == 1, "Variables {} are not of the same entity".format(variables)
+        beneficiary_masks = self.beneficiary_masks_by_simulation_type[simulation_type][entity_key_plurals.pop()]
+        return beneficiary_masks.combination_count(include, exclude = exclude) / 10 ** 3
+
     def compute_difference(self, target = "reference", default = 'actual', amount = True, beneficiaries = True,
             absolute = True, relative = True):
         '''
@@ -159,6 +290,195 @@ class Aggregates(object):
                 ) / abs(base_data_frame['{}_{}'.format(default, quantity)])
         return difference_data_frame
 
+    def compute_monthly_aggregates(self, monthly_arrays, weights, simulation_type = 'reference'):
+        """
+        Returns the monthly statistics of reducer_by_name of a variable, amounts and beneficiaries by default
+
+        The monthly arrays summed by calculate_add (see get_monthly_arrays) are reduced like the annual values, so that
+        monthly and annual statistics are rounded alike. The monthly statistics are nan for the variables computed on
+        a yearly basis.
+        """
+        monthly_data = dict()
+        for name, reducer in self.reducer_by_name.iteritems():
+            for month in range(12):
+                if monthly_arrays is None:
+                    value = nan
+                else:
+                    value = reduce_values(reducer, monthly_arrays[month], weights,
+                        chunk_size = self.reduction_chunk_size)
+                monthly_data['{}_{}_{:02d}'.format(simulation_type, name, month + 1)] = value
+        return monthly_data
+
+    def compute_overlaps(self, entity_key_plural, simulation_type = 'reference'):
+        """
+        Returns the matrix of the numbers of beneficiaries (in thousands) of each pair of variables of an entity
+
+        The diagonal holds the beneficiaries of each variable. The beneficiary masks must have been kept (see
+        keep_beneficiary_masks).
+        """
+        assert self.keep_beneficiary_masks, "Beneficiary masks are not kept"
+        if simulation_type not in self.beneficiary_masks_by_simulation_type:
+            self.compute_simulation_aggregates(simulation_type)
+        beneficiary_masks = self.beneficiary_masks_by_simulation_type[simulation_type][entity_key_plural]
+        return beneficiary_masks.overlap_matrix() / 10 ** 3
+
+    def compute_preview_aggregates(self, fraction = .05, strata_count = 10, seed = 0, reference = True,
+            reform = True, household_entity_key_plural = 'menages'):
+        """
+        Computes approximate aggregate amounts and their standard errors on a stratified subsample of the households
+
+        The subsample is drawn once by survey and reused for every reform and year: only the simulations of the
+        sampled households are computed. Calibrated weights (see calibrate_weights) are used by the preview too.
+
+        Parameters
+        ----------
+        fraction : float
+                   fraction of the households in the subsample
+        strata_count : int
+                       number of strata, built as quantiles of the household weights
+        seed : int
+               seed of the random draw
+        household_entity_key_plural : string
+                                      entity used as the sampling unit
+        """
+        survey_scenario = self.survey_scenario
+        entity_class_by_key_plural = self.reference_simulation.tax_benefit_system.entity_class_by_key_plural
+        household_id_column = entity_class_by_key_plural[household_entity_key_plural].index_for_person_variable_name
+        id_columns = [
+            entity_class.index_for_person_variable_name
+            for entity_key_plural, entity_class in entity_class_by_key_plural.iteritems()
+            if not entity_class.is_persons_entity and entity_key_plural != household_entity_key_plural
+            ]
+        input_data_frame = survey_scenario.input_data_frame
+        weight_columns = [
+            weight
+            for weight in set(self.weight_column_name_by_entity_key_plural.values())
+            if weight in input_data_frame.columns
+            ]
+        household_weights = input_data_frame.groupby(household_id_column)[
+            self.weight_column_name_by_entity_key_plural[household_entity_key_plural]].first()
+        sample = get_stratified_sample(
+            household_weights.index.values,
+            household_weights.values,
+            fraction,
+            strata_count = strata_count,
+            seed = seed,
+            sampling_unit = household_entity_key_plural,
+            )
+        preview_input_data_frame = subsample_input_data_frame(
+            input_data_frame,
+            sample,
+            household_id_column,
+            id_columns = id_columns,
+            weight_columns = weight_columns,
+            )
+        preview_survey_scenario = survey_scenario.__class__().init_from_data_frame(
+            input_data_frame = preview_input_data_frame,
+            tax_benefit_system = survey_scenario.tax_benefit_system,
+            reference_tax_benefit_system = survey_scenario.reference_tax_benefit_system,
+            year = self.year,
+            )
+        preview = Aggregates(survey_scenario = preview_survey_scenario)
+        preview.filter_by = self.filter_by
+        preview.varlist = self.varlist
+
+        # Household (position in the sample) of each entity of the subsample
+        household_index_by_entity_key_plural = dict()
+        household_index = preview_input_data_frame[household_id_column].values
+        for entity_key_plural, entity_class in entity_class_by_key_plural.iteritems():
+            if entity_class.is_persons_entity:
+                household_index_by_entity_key_plural[entity_key_plural] = household_index
+                continue
+            entity_index = preview_input_data_frame[entity_class.index_for_person_variable_name].values
+            household_index_by_entity_key_plural[entity_key_plural] = numpy.empty(entity_index.max() + 1, dtype = int)
+            household_index_by_entity_key_plural[entity_key_plural][entity_index] = household_index
+
+        # Calibrated weights of the sampled entities, expanded like the survey weights. Entity ids of the input data
+        # frame are the positions of the entities in the simulations.
+        if self.weight_by_entity_key_plural:
+            selected = select_sampled_rows(input_data_frame, sample, household_id_column)[0]
+            expansions = get_expansions(sample)
+            for entity_key_plural, weights in self.weight_by_entity_key_plural.iteritems():
+                entity_class = entity_class_by_key_plural[entity_key_plural]
+                if entity_class.is_persons_entity:
+                    positions = numpy.flatnonzero(selected)
+                elif entity_key_plural == household_entity_key_plural:
+                    positions = sample.ids
+                else:
+                    positions = numpy.unique(input_data_frame[entity_class.index_for_person_variable_name].values[
+                        selected])
+                preview.weight_by_entity_key_plural[entity_key_plural] = weights[positions] * expansions[
+                    sample.strata[household_index_by_entity_key_plural[entity_key_plural]]]
+
+        simulation_types = list()
+        if reference:
+            simulation_types.append('reference')
+        if reform:
+            simulation_types.append('reform')
+
+        data_frames = list()
+        for simulation_type in simulation_types:
+            simulation = getattr(preview, '{}_simulation'.format(simulation_type))
+            column_by_name = simulation.tax_benefit_system.column_by_name
+            data_frame = pandas.DataFrame()
+            for variable in self.varlist:
+                column = column_by_name[variable]
+                weights = preview.get_weights(simulation_type, column.entity_key_plural)
+                if self.filter_by:
+                    weights = weights * simulation.calculate(
+                        "{}_{}".format(self.filter_by, column.entity_key_plural))
+                values = simulation.calculate_add(variable)
+                household_index = household_index_by_entity_key_plural[column.entity_key_plural]
+                amount, amount_standard_error = estimate_total(sample, numpy.bincount(
+                    household_index, weights = values * weights, minlength = len(sample.ids)))
+                beneficiaries, beneficiaries_standard_error = estimate_total(sample, numpy.bincount(
+                    household_index, weights = (values != 0) * weights, minlength = len(sample.ids)))
+                variable_data = {
+                    '{}_amount'.format(simulation_type): amount / 10 ** 6,
+                    '{}_amount_standard_error'.format(simulation_type): amount_standard_error / 10 ** 6,
+                    '{}_beneficiaries'.format(simulation_type): beneficiaries / 10 ** 3,
+                    '{}_beneficiaries_standard_error'.format(simulation_type): beneficiaries_standard_error / 10 ** 3,
+                    }
+                if not data_frames:
+                    variable_data.update(label = column.label, entity = column.entity_key_plural)
+                data_frame = pandas.concat((data_frame, pandas.DataFrame(data = variable_data, index = [variable])))
+            data_frames.append(data_frame)
+
+        self.preview_data_frame = pandas.concat(data_frames, axis = 1).loc[self.varlist]
+        return self.preview_data_frame
+
+    def copy_reference_beneficiary_mask(self, variable):
+        """
+        Copies the reference beneficiary mask of a variable to the reform ones, returns False if it has not been kept
+        """
+        try:
+            entity_key_plural = self.get_beneficiary_masks_entity_key_plural(variable, 'reference')
+        except KeyError:
+            return False
+        mask = self.beneficiary_masks_by_simulation_type['reference'][entity_key_plural].get_mask(variable)
+        self.get_beneficiary_masks('reform', entity_key_plural).add_mask(variable, mask)
+        return True
+
+    def create_memory_manager(self, simulation_type):
+        """
+        Returns a memory manager ordering the varlist and evicting the intermediates of the simulation
+        """
+        simulation = getattr(self, '{}_simulation'.format(simulation_type))
+        protected_variables = set(self.weight_column_name_by_entity_key_plural.values())
+        if self.filter_by:
+            protected_variables.update(
+                "{}_{}".format(self.filter_by, entity_key_plural)
+                for entity_key_plural in self.weight_column_name_by_entity_key_plural
+                )
+        if self.memory_usage_by_phase is None:
+            self.memory_usage_by_phase = collections.OrderedDict()
+        return MemoryManager(
+            simulation,
+            list(self.varlist),
+            budget = self.memory_budget,
+            protected_variables = protected_variables,
+            )
+
     def create_description(self):
         '''
         Creates a description dataframe
@@ -171,10 +491,90 @@ class Aggregates(object):
             u"Données d'enquêtes de l'année %s" % str(self.simulation.input_table.survey_year),
             ])
 
+    def compute_simulation_aggregates(self, simulation_type, reference_data_frame = None):
+        """
+        Returns the aggregates of the varlist computed on the reference or the reform simulation
+
+        Parameters
+        ----------
+        simulation_type : string
+                          reference or reform
+        reference_data_frame : DataFrame
+                               reference aggregates, reused for the variables unaffected by the reform if
+                               reuse_unaffected_aggregates is set
+        """
+        assert simulation_type in ['reference', 'reform']
+        # The memory manager is created first, so that the holders filled while checking the unaffected variables are
+        # not protected from eviction
+        if self.memory_budget is not None:
+            memory_manager = self.create_memory_manager(simulation_type)
+            variables = memory_manager.variables
+        else:
+            memory_manager = None
+            variables = self.varlist
+        reuse_unaffected_aggregates = self.reuse_unaffected_aggregates and reference_data_frame is not None
+        if simulation_type == 'reform' and reuse_unaffected_aggregates and (
+                self.reform_simulation is not self.reference_simulation):
+            unaffected_variables = self.get_unaffected_variables()
+            reform_column_by_reference_column = dict(
+                (column, 'reform_{}'.format(column[len('reference_'):]))
+                for column in reference_data_frame.columns
+                if column.startswith('reference_')
+                )
+            reused_columns = ['entity', 'label'] + sorted(reform_column_by_reference_column)
+            if self.keep_beneficiary_masks:
+                # Variables whose reference beneficiary mask has not been kept are computed to get their mask
+                unaffected_variables = set(
+                    variable
+                    for variable in unaffected_variables
+                    if self.copy_reference_beneficiary_mask(variable)
+                    )
+        else:
+            unaffected_variables = set()
+
+        # Reductions run in a thread pool while the simulation computes the next variables
+        pool = ThreadPool(self.pipeline_workers) if self.pipeline_workers else None
+        pending_results = collections.deque()
+        variable_results = list()
+        try:
+            for variable in variables:
+                if variable in unaffected_variables:
+                    variable_results.append(reference_data_frame.loc[[variable], reused_columns].rename(
+                        columns = reform_column_by_reference_column))
+                elif pool is None:
+                    variable_results.append(self.compute_variable_aggregates(
+                        variable, filter_by = self.filter_by, simulation_type = simulation_type))
+                else:
+                    # Bound the number of variables whose arrays are held by pending reductions
+                    while len(pending_results) >= self.pipeline_queue_size:
+                        pending_results.popleft().wait()
+                    variable_arrays = self.get_variable_arrays(
+                        variable, filter_by = self.filter_by, simulation_type = simulation_type)
+                    result = pool.apply_async(self.reduce_variable_arrays, (variable, variable_arrays),
+                        dict(simulation_type = simulation_type))
+                    pending_results.append(result)
+                    variable_results.append(result)
+                if memory_manager is not None:
+                    memory_manager.release(variable)
+            data_frames = [
+                variable_result if isinstance(variable_result, pandas.DataFrame) else variable_result.get()
+                for variable_result in variable_results
+                ]
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        data_frame = pandas.concat(data_frames) if data_frames else pandas.DataFrame()
+        if memory_manager is not None:
+            self.memory_usage_by_phase[simulation_type] = memory_manager.report()
+            log.info("Memory usage of the {} aggregates: {}".format(
+                simulation_type, self.memory_usage_by_phase[simulation_type]))
+        return data_frame
+
     def compute_variable_aggregates(self, variable, filter_by = None, simulation_type = 'reference'):
         """
         Returns aggregate spending, and number of beneficiaries
-        for the relevant entity level
+        for the relevant entity level, or the statistics of reducer_by_name
 
         Parameters
         ----------
@@ -186,6 +586,163 @@ class Aggregates(object):
                           reference or reform or actual
         """
         assert simulation_type in ['reference', 'reform']
+        variable_arrays = self.get_variable_arrays(variable, filter_by = filter_by, simulation_type = simulation_type)
+        return self.reduce_variable_arrays(variable, variable_arrays, simulation_type = simulation_type)
+
+    def export_cube(self, directory, simulation_types = None, extra_variables = None):
+        """
+        Saves the entity values of the varlist, the weights and the filters in a directory of .npy files
+
+        A manifest.json file describes the cube, which can then be aggregated without any simulation by a
+        CubeAggregates.
+
+        Parameters
+        ----------
+        directory : string
+                    directory of the cube
+        simulation_types : list
+                           simulation types to export, by default reference and reform
+        extra_variables : list
+                          other variables to export, e.g. variables to filter by or to break the aggregates down by
+        """
+        if simulation_types is None:
+            simulation_types = ['reference', 'reform']
+        if self.totals_df is None:
+            self.load_amounts_from_file()
+
+        manifest = dict(
+            filter_by = self.filter_by,
+            simulations = dict(),
+            varlist = list(self.varlist),
+            weight_column_name_by_entity_key_plural = self.weight_column_name_by_entity_key_plural,
+            year = self.year,
+            )
+        exported_simulation_type_by_id = dict()
+        for simulation_type in simulation_types:
+            simulation = getattr(self, '{}_simulation'.format(simulation_type))
+            if id(simulation) in exported_simulation_type_by_id:
+                # Without reform, both simulation types share the same simulation
+                manifest['simulations'][simulation_type] = manifest['simulations'][
+                    exported_simulation_type_by_id[id(simulation)]]
+                continue
+            exported_simulation_type_by_id[id(simulation)] = simulation_type
+            column_by_name = simulation.tax_benefit_system.column_by_name
+            variables = list(self.varlist) + list(extra_variables or list())
+            entity_key_plurals = set(column_by_name[variable].entity_key_plural for variable in variables)
+            variables.extend(
+                self.weight_column_name_by_entity_key_plural[entity_key_plural]
+                for entity_key_plural in sorted(entity_key_plurals)
+                )
+            if self.filter_by:
+                variables.extend(
+                    "{}_{}".format(self.filter_by, entity_key_plural)
+                    for entity_key_plural in sorted(entity_key_plurals)
+                    )
+            simulation_directory = os.path.join(directory, simulation_type)
+            if not os.path.isdir(simulation_directory):
+                os.makedirs(simulation_directory)
+            variable_by_name = collections.OrderedDict()
+            for variable in variables:
+                if variable in variable_by_name:
+                    continue
+                if variable in self.weight_column_name_by_entity_key_plural.itervalues():
+                    array = self.get_weights(simulation_type, column_by_name[variable].entity_key_plural)
+                elif variable in self.varlist:
+                    array = simulation.calculate_add(variable)
+                else:
+                    array = simulation.calculate(variable)
+                file_name = os.path.join(simulation_type, '{}.npy'.format(variable))
+                numpy.save(os.path.join(directory, file_name), array)
+                variable_by_name[variable] = dict(
+                    entity_key_plural = column_by_name[variable].entity_key_plural,
+                    file_name = file_name,
+                    label = column_by_name[variable].label,
+                    )
+            manifest['simulations'][simulation_type] = variable_by_name
+
+        if self.totals_df is not None and not self.totals_df.empty:
+            self.totals_df.to_csv(os.path.join(directory, 'actual.csv'))
+        with open(os.path.join(directory, 'manifest.json'), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent = 2)
+
+    def get_beneficiary_masks(self, simulation_type, entity_key_plural):
+        """
+        Returns the beneficiary masks of an entity, creating them if needed
+        """
+        beneficiary_masks_by_entity_key_plural = self.beneficiary_masks_by_simulation_type.setdefault(
+            simulation_type, dict())
+        if entity_key_plural not in beneficiary_masks_by_entity_key_plural:
+            beneficiary_masks_by_entity_key_plural[entity_key_plural] = BeneficiaryMasks(
+                self.get_weights(simulation_type, entity_key_plural))
+        return beneficiary_masks_by_entity_key_plural[entity_key_plural]
+
+    def get_beneficiary_masks_entity_key_plural(self, variable, simulation_type = 'reference'):
+        for entity_key_plural, beneficiary_masks in self.beneficiary_masks_by_simulation_type.get(
+                simulation_type, dict()).iteritems():
+            if variable in beneficiary_masks.variables:
+                return entity_key_plural
+        raise KeyError("No beneficiary mask kept for variable {} of the {} simulation".format(
+            variable, simulation_type))
+
+    def get_unaffected_variables(self):
+        """
+        Returns the variables of the varlist whose reform aggregates are the reference ones
+
+        The variables unaffected by the reform are found by a static analysis of the formulas, which misses the
+        variables and parameters used through helper functions (see reform_delta). To guard against it,
+        unaffected_check_count unaffected variables, drawn at random, are computed on both simulations and their
+        values compared entity by entity. Any difference disables the reuse.
+        """
+        affected_variables = get_affected_variables(self.reference_simulation, self.reform_simulation, self.varlist)
+        unaffected_variables = [variable for variable in self.varlist if variable not in affected_variables]
+        log.info("Variables unaffected by the reform: {}".format(unaffected_variables))
+        if not self.unaffected_check_count or not unaffected_variables:
+            return set(unaffected_variables)
+
+        checked_variables = random.Random(self.year).sample(
+            unaffected_variables, min(self.unaffected_check_count, len(unaffected_variables)))
+        for variable in checked_variables:
+            reference_values = numpy.asarray(self.reference_simulation.calculate_add(variable))
+            reform_values = numpy.asarray(self.reform_simulation.calculate_add(variable))
+            if reference_values.shape == reform_values.shape:
+                equal = reference_values == reform_values
+                if reference_values.dtype.kind == 'f':
+                    equal |= numpy.isnan(reference_values) & numpy.isnan(reform_values)
+            else:
+                equal = False
+            if not numpy.all(equal):
+                log.warning("Reform values of {} differ from the reference ones although the variable is deemed "
+                    "unaffected: all the variables are computed".format(variable))
+                return set()
+        return set(unaffected_variables)
+
+    def get_monthly_arrays(self, variable, simulation_type = 'reference'):
+        """
+        Returns the monthly arrays of a variable computed by calculate_add, None if it is computed on a yearly basis
+
+        The months not computed, such as the months a dated formula doesn't cover, are zeros, as in the annual sum.
+        Permanent variables have the same array for every period and are deemed yearly.
+        """
+        simulation = getattr(self, '{}_simulation'.format(simulation_type))
+        if simulation.tax_benefit_system.column_by_name[variable].is_permanent:
+            return None
+        holder = simulation.get_or_new_holder(variable)
+        monthly_arrays = [
+            holder.get_array(simulation.period.start.offset(month, u'month').period(u'month'))
+            for month in range(12)
+            ]
+        computed_arrays = [array for array in monthly_arrays if array is not None]
+        if not computed_arrays:
+            return None
+        zeros = numpy.zeros_like(computed_arrays[0])
+        return [zeros if array is None else array for array in monthly_arrays]
+
+    def get_variable_arrays(self, variable, filter_by = None, simulation_type = 'reference'):
+        """
+        Returns the arrays of a variable needed by reduce_variable_arrays
+
+        This is the only step of the aggregation of a variable which uses the simulation.
+        """
         prefixed_simulation = '{}_simulation'.format(simulation_type)
         simulation = getattr(self, prefixed_simulation)
         column_by_name = simulation.tax_benefit_system.column_by_name
@@ -194,38 +751,35 @@ class Aggregates(object):
         assert weight in column_by_name, "{} not a variable of the {} tax_benefit_system".format(
             weight, simulation_type)
         # amounts and beneficiaries from current data and default data if exists
+        values = simulation.calculate_add(variable)
         # Build weights for each entity
-        data = pandas.DataFrame({
-            variable: simulation.calculate_add(variable),
-            weight: simulation.calculate(weight),
-            })
+        weights = self.get_weights(simulation_type, column.entity_key_plural)
         if filter_by:
             filter_dummy = simulation.calculate("{}_{}".format(filter_by, column.entity_key_plural))
+            weights = weights * filter_dummy
 
-        try:
-            amount = int(
-                (data[variable] * data[weight] * filter_dummy / 10 ** 6).sum().round()
-                )
-        except:
-            amount = nan
-        try:
-            beneficiaries = int(
-                ((data[variable] != 0) * data[weight] * filter_dummy / 10 ** 3).sum().round()
+        if self.keep_beneficiary_masks:
+            self.get_beneficiary_masks(simulation_type, column.entity_key_plural).add_mask(
+                variable,
+                ((values != 0) * filter_dummy != 0) if filter_by else (values != 0),
                 )
-        except:
-            beneficiaries = nan
-
-        variable_data_frame = pandas.DataFrame(
-            data = {
-                'label': column_by_name[variable].label,
-                'entity': column_by_name[variable].entity_key_plural,
-                '{}_amount'.format(simulation_type): amount,
-                '{}_beneficiaries'.format(simulation_type): beneficiaries,
-                },
-            index = [variable],
+
+        return dict(
+            entity = column.entity_key_plural,
+            label = column.label,
+            monthly_arrays = self.get_monthly_arrays(variable, simulation_type) if self.monthly else None,
+            values = values,
+            weights = weights,
             )
 
-        return variable_data_frame
+    def get_weights(self, simulation_type, entity_key_plural):
+        '''
+        Returns the weights of the entity, calibrated ones if available
+        '''
+        if entity_key_plural in self.weight_by_entity_key_plural:
+            return self.weight_by_entity_key_plural[entity_key_plural]
+        simulation = getattr(self, '{}_simulation'.format(simulation_type))
+        return simulation.calculate(self.weight_column_name_by_entity_key_plural[entity_key_plural])
 
     def load_amounts_from_file(self, filename = None, year = None):
         '''
@@ -274,6 +828,29 @@ class Aggregates(object):
             self.totals_df = pandas.DataFrame()
             return
 
+    def reduce_variable_arrays(self, variable, variable_arrays, simulation_type = 'reference'):
+        """
+        Returns the data frame of the statistics of a variable computed from its arrays
+
+        It doesn't use the simulation, so that it can run in another thread (see pipeline_workers).
+        """
+        variable_data = {
+            'label': variable_arrays['label'],
+            'entity': variable_arrays['entity'],
+            }
+        for name, reducer in self.reducer_by_name.iteritems():
+            try:
+                value = reduce_values(reducer, variable_arrays['values'], variable_arrays['weights'],
+                    chunk_size = self.reduction_chunk_size)
+            except Exception:
+                log.exception("Reduction of {} by {} failed".format(variable, name))
+                value = nan
+            variable_data['{}_{}'.format(simulation_type, name)] = value
+        if self.monthly:
+            variable_data.update(self.compute_monthly_aggregates(
+                variable_arrays['monthly_arrays'], variable_arrays['weights'], simulation_type = simulation_type))
+        return pandas.DataFrame(data = variable_data, index = [variable])
+
     def save_table(self, directory = None, filename = None, table_format = None):
         '''
         Saves the table to csv or xls (default) format 
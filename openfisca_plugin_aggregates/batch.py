@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compute the aggregates described by a job specification, resuming from the checkpoints of a previous run
+
+The job specification is a JSON file such as:
+
+    {
+        "data_year": 2009,
+        "years": [2013, 2014],
+        "reforms": {"plf2015": "openfisca_france.reforms.plf2015"},
+        "varlist": ["af", "cf", "rsa"],
+        "filter_by": "champm",
+        "output_directory": "aggregates",
+        "table_format": "csv"
+    }
+
+Each reform is given by the name of a module providing a build_reform function. The work is split in units, one for
+the reference simulation of each year and one for each reform and year. Each completed unit is saved in the
+checkpoints subdirectory of the output directory and is not computed again when the job is run again, unless the
+fields of the job specification its aggregates depend on (data year, filter, monthly, varlist, and for the reform
+units, reform module and reuse of the unaffected reference aggregates) have changed.
+"""
+
+
+import argparse
+import hashlib
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import traceback
+
+import pandas
+
+from openfisca_france_data.input_data_builders import get_input_data_frame
+from openfisca_france_data.surveys import SurveyScenario
+
+from .aggregates import Aggregates
+
+
+default_job_spec = dict(
+    data_year = 2009,
+    filter_by = None,
+    memory_budget = None,
+    monthly = False,
+    output_directory = '.',
+    pipeline_workers = 0,
+    reforms = dict(),
+    reuse_unaffected_aggregates = False,
+    table_format = 'csv',
+    varlist = None,
+    years = list(),
+    )
+log = logging.getLogger(__name__)
+
+
+def build_survey_scenario(job_spec, year, reform_name = None):
+    # The tax and benefit system extended with the survey input variables is only built by the tests of
+    # openfisca_france_data: they are imported when a unit is computed, not when this module is
+    from openfisca_france_data.tests import base
+
+    input_data_frame = get_input_data_frame(job_spec['data_year'])
+    if reform_name is None:
+        return SurveyScenario().init_from_data_frame(
+            input_data_frame = input_data_frame,
+            tax_benefit_system = base.france_data_tax_benefit_system,
+            year = year,
+            )
+    reform_module = importlib.import_module(job_spec['reforms'][reform_name])
+    return SurveyScenario().init_from_data_frame(
+        input_data_frame = input_data_frame,
+        tax_benefit_system = reform_module.build_reform(base.france_data_tax_benefit_system),
+        # The reference simulation is only needed to find the variables unaffected by the reform
+        reference_tax_benefit_system = (
+            base.france_data_tax_benefit_system if job_spec['reuse_unaffected_aggregates'] else None),
+        year = year,
+        )
+
+
+def compute_unit(job_spec, unit):
+    """
+    Computes the aggregates of a unit and saves them in its checkpoint
+    """
+    year, reform_name, simulation_type = unit
+    log.info("Computing {} aggregates of {} for year {}".format(simulation_type, reform_name or 'reference', year))
+    aggregates = Aggregates(survey_scenario = build_survey_scenario(job_spec, year, reform_name))
+    if job_spec['filter_by'] is not None:
+        aggregates.filter_by = job_spec['filter_by']
+    if job_spec['varlist'] is not None:
+        aggregates.varlist = job_spec['varlist']
+    aggregates.memory_budget = job_spec['memory_budget']
+    aggregates.monthly = job_spec['monthly']
+    aggregates.pipeline_workers = job_spec['pipeline_workers']
+    aggregates.reuse_unaffected_aggregates = job_spec['reuse_unaffected_aggregates']
+
+    if simulation_type == 'reference':
+        data_frame = aggregates.compute_simulation_aggregates('reference')
+        # Actual amounts are saved with the reference aggregates of the year
+        aggregates.load_amounts_from_file()
+        data_frame = pandas.concat((data_frame, aggregates.totals_df), axis = 1).loc[aggregates.varlist]
+    else:
+        reference_path = get_checkpoint_path(job_spec, (year, None, 'reference'))
+        data_frame = aggregates.compute_simulation_aggregates(
+            'reform',
+            reference_data_frame = pandas.read_pickle(reference_path) if os.path.exists(reference_path) else None,
+            )
+        del data_frame['entity']
+        del data_frame['label']
+    save_checkpoint(job_spec, unit, data_frame)
+
+
+def compute_unit_safely(arguments):
+    job_spec, unit = arguments
+    try:
+        compute_unit(job_spec, unit)
+    except Exception:
+        log.error("Computation of unit {} failed:\n{}".format(unit, traceback.format_exc()))
+        return unit, False
+    return unit, True
+
+
+def get_checkpoint_path(job_spec, unit):
+    """
+    Returns the path of the checkpoint of a unit, which includes the hash of the fields its aggregates depend on
+    """
+    year, reform_name, simulation_type = unit
+    fields = dict((key, job_spec[key]) for key in ['data_year', 'filter_by', 'monthly', 'varlist'])
+    if reform_name is not None:
+        fields['reform'] = job_spec['reforms'][reform_name]
+        # Reused reference aggregates may miss the changes hidden in the helper functions of the formulas
+        fields['reuse_unaffected_aggregates'] = job_spec['reuse_unaffected_aggregates']
+    fields_hash = hashlib.sha1(json.dumps(fields, sort_keys = True)).hexdigest()[:12]
+    return os.path.join(job_spec['output_directory'], 'checkpoints', '{}-{}-{}-{}.pkl'.format(
+        year, reform_name or 'reference', simulation_type, fields_hash))
+
+
+def get_units(job_spec):
+    """
+    Returns the (year, reform_name, simulation_type) units of a job, reference ones first
+    """
+    units = [(year, None, 'reference') for year in job_spec['years']]
+    units.extend(
+        (year, reform_name, 'reform')
+        for year in job_spec['years']
+        for reform_name in sorted(job_spec['reforms'])
+        )
+    return units
+
+
+def load_job_spec(file_path):
+    with open(file_path) as job_spec_file:
+        job_spec = json.load(job_spec_file)
+    unknown_keys = set(job_spec) - set(default_job_spec)
+    assert not unknown_keys, "Unknown keys in job specification: {}".format(sorted(unknown_keys))
+    return dict(default_job_spec, **job_spec)
+
+
+def run_job(job_spec, workers = 1, restart = False):
+    """
+    Computes the units of a job which have no checkpoint yet, then writes the tables of the completed units
+
+    Returns the list of the failed units.
+    """
+    checkpoints_directory = os.path.join(job_spec['output_directory'], 'checkpoints')
+    if not os.path.isdir(checkpoints_directory):
+        os.makedirs(checkpoints_directory)
+
+    failed_units = list()
+    for simulation_type in ['reference', 'reform']:
+        # Reform units are computed once the reference ones are completed, to be able to reuse their aggregates
+        pending_units = [
+            unit
+            for unit in get_units(job_spec)
+            if unit[2] == simulation_type and (restart or not os.path.exists(get_checkpoint_path(job_spec, unit)))
+            ]
+        log.info("{} {} units to compute".format(len(pending_units), simulation_type))
+        arguments = [(job_spec, unit) for unit in pending_units]
+        if workers > 1 and len(pending_units) > 1:
+            pool = multiprocessing.Pool(min(workers, len(pending_units)))
+            try:
+                results = list(pool.imap_unordered(compute_unit_safely, arguments))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [compute_unit_safely(argument) for argument in arguments]
+        failed_units.extend(unit for unit, success in results if not success)
+
+    write_tables(job_spec)
+    return failed_units
+
+
+def save_checkpoint(job_spec, unit, data_frame):
+    checkpoint_path = get_checkpoint_path(job_spec, unit)
+    temporary_path = '{}.{}.tmp'.format(checkpoint_path, os.getpid())
+    data_frame.to_pickle(temporary_path)
+    # Renaming is atomic: an interrupted run never leaves a partial checkpoint behind
+    os.rename(temporary_path, checkpoint_path)
+
+
+def write_tables(job_spec):
+    """
+    Writes a table for each year and reform whose units are all completed
+    """
+    for year in job_spec['years']:
+        reference_path = get_checkpoint_path(job_spec, (year, None, 'reference'))
+        if not os.path.exists(reference_path):
+            continue
+        reference_data_frame = pandas.read_pickle(reference_path)
+        data_frame_by_reform_name = dict(reference = reference_data_frame)
+        for reform_name in job_spec['reforms']:
+            reform_path = get_checkpoint_path(job_spec, (year, reform_name, 'reform'))
+            if os.path.exists(reform_path):
+                data_frame_by_reform_name[reform_name] = pandas.concat(
+                    (reference_data_frame, pandas.read_pickle(reform_path)), axis = 1).loc[reference_data_frame.index]
+
+        for reform_name, data_frame in data_frame_by_reform_name.iteritems():
+            file_path = os.path.join(job_spec['output_directory'], 'aggregates_{}_{}.{}'.format(
+                year, reform_name, job_spec['table_format']))
+            if job_spec['table_format'] == 'xls':
+                writer = pandas.ExcelWriter(str(file_path))
+                data_frame.to_excel(writer, "aggregates", header = True)
+                writer.save()
+            else:
+                data_frame.to_csv(file_path, header = True)
+            log.info("Aggregates written to {}".format(file_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('job_spec', help = 'path of the JSON job specification')
+    parser.add_argument('-j', '--workers', default = 1, type = int, help = 'number of local worker processes')
+    parser.add_argument('--restart', action = 'store_true', default = False,
+        help = 'ignore the checkpoints of previous runs')
+    parser.add_argument('-v', '--verbose', action = 'store_true', default = False, help = "increase output verbosity")
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.DEBUG if args.verbose else logging.INFO, stream = sys.stdout)
+
+    job_spec = load_job_spec(args.job_spec)
+    failed_units = run_job(job_spec, workers = args.workers, restart = args.restart)
+    if failed_units:
+        log.error("Failed units: {}".format(failed_units))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Calibration of entity weights on administrative totals (calmar-like raking and linear methods)"""
+
+
+from __future__ import division
+
+import logging
+
+import numpy
+from numpy import nan
+
+
+log = logging.getLogger(__name__)
+
+
+calibration_methods = ('linear', 'raking')
+
+
+def calibrate_weights(margin_matrix, initial_weights, targets, method = 'raking', max_iterations = 50,
+        tolerance = 1e-6):
+    """
+    Returns calibrated weights and convergence diagnostics
+
+    The calibrated weights w = d * F(X.lambda) are found by Newton iterations on the calibration equations
+    X'.w = targets, F being exp for raking and 1 + u for the linear method.
+
+    Parameters
+    ----------
+    margin_matrix : array
+                    (entities x margins) array of the calibration variables
+    initial_weights : array
+                      initial (design) weights of the entities
+    targets : array
+              total to reach for each margin
+    method : string
+             linear or raking
+    max_iterations : int
+                     maximal number of Newton iterations
+    tolerance : float
+                maximal relative error on the margins to stop iterating
+    """
+    assert method in calibration_methods, "Unknown calibration method {}".format(method)
+    initial_weights = numpy.asarray(initial_weights, dtype = float)
+    margin_matrix = numpy.asarray(margin_matrix, dtype = float).reshape((len(initial_weights), -1))
+    targets = numpy.asarray(targets, dtype = float).ravel()
+    assert margin_matrix.shape[1] == len(targets)
+
+    # Normalize each margin by its target to keep the Newton system well conditioned
+    scale = numpy.where(targets != 0, numpy.abs(targets), 1)
+    margin_matrix = margin_matrix / scale
+    targets = targets / scale
+
+    lambdas = numpy.zeros(len(targets))
+    ratios = numpy.ones(len(initial_weights))
+    error_history = list()
+    converged = False
+    iteration = 0
+    for iteration in range(1, max_iterations + 1):
+        u = margin_matrix.dot(lambdas)
+        if method == 'raking':
+            ratios = numpy.exp(u)
+            derivatives = ratios
+        else:
+            ratios = 1 + u
+            derivatives = numpy.ones_like(u)
+        weights = initial_weights * ratios
+        residuals = margin_matrix.T.dot(weights) - targets
+        max_relative_error = float(numpy.abs(residuals).max()) if len(residuals) else 0
+        error_history.append(max_relative_error)
+        if max_relative_error < tolerance:
+            converged = True
+            break
+        jacobian = (margin_matrix * (initial_weights * derivatives)[:, None]).T.dot(margin_matrix)
+        lambdas = lambdas - numpy.linalg.pinv(jacobian).dot(residuals)
+        if not numpy.all(numpy.isfinite(lambdas)):
+            log.warning("Calibration diverged after {} iterations".format(iteration))
+            break
+
+    weights = initial_weights * ratios
+    diagnostics = dict(
+        converged = converged,
+        iterations = iteration,
+        error_history = error_history,
+        max_relative_error = error_history[-1] if error_history else nan,
+        ratio_min = float(ratios.min()) if len(ratios) else nan,
+        ratio_max = float(ratios.max()) if len(ratios) else nan,
+        negative_weights = int((weights < 0).sum()),
+        )
+    if not converged:
+        log.warning("Calibration did not converge: max relative error {}".format(diagnostics['max_relative_error']))
+    return weights, diagnostics
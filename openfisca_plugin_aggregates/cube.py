@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Aggregates computed from a cube of entity values exported by Aggregates.export_cube, without any simulation"""
+
+
+import json
+import logging
+import os
+
+import numpy
+import pandas
+
+from .aggregates import Aggregates
+from .reducers import get_default_reducer_by_name
+
+
+log = logging.getLogger(__name__)
+
+
+class CubeColumn(object):
+    entity_key_plural = None
+    label = None
+    name = None
+
+    def __init__(self, name, entity_key_plural, label):
+        self.entity_key_plural = entity_key_plural
+        self.label = label
+        self.name = name
+
+
+class CubeTaxBenefitSystem(object):
+    column_by_name = None
+
+    def __init__(self, column_by_name):
+        self.column_by_name = column_by_name
+
+
+class CubeSimulation(object):
+    """
+    Read-only simulation whose variables are the memory-mapped arrays of a cube
+    """
+    array_by_name = None
+    directory = None
+    tax_benefit_system = None
+    variable_by_name = None
+
+    def __init__(self, directory, variable_by_name):
+        self.array_by_name = dict()
+        self.directory = directory
+        self.tax_benefit_system = CubeTaxBenefitSystem(dict(
+            (name, CubeColumn(name, variable['entity_key_plural'], variable['label']))
+            for name, variable in variable_by_name.iteritems()
+            ))
+        self.variable_by_name = variable_by_name
+
+    def calculate(self, column_name):
+        array = self.array_by_name.get(column_name)
+        if array is None:
+            variable = self.variable_by_name.get(column_name)
+            if variable is None:
+                raise KeyError("Variable {} is not in the cube {}".format(column_name, self.directory))
+            array = numpy.load(os.path.join(self.directory, variable['file_name']), mmap_mode = 'r')
+            self.array_by_name[column_name] = array
+        return array
+
+    # The annual values of the varlist are stored in the cube
+    calculate_add = calculate
+
+
+class CubeAggregates(Aggregates):
+    """
+    Aggregates of a cube exported by Aggregates.export_cube
+
+    The varlist and the filter can be changed, within the variables stored in the cube. Monthly aggregates, previews,
+    memory budgets and the reuse of the reference aggregates unaffected by the reform (reuse_unaffected_aggregates)
+    need the simulations and are not available.
+    """
+    directory = None
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'manifest.json')) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.beneficiary_masks_by_simulation_type = dict()
+        self.filter_by = manifest['filter_by']
+        self.reducer_by_name = get_default_reducer_by_name()
+        self.varlist = manifest['varlist']
+        self.weight_by_entity_key_plural = dict()
+        self.weight_column_name_by_entity_key_plural = manifest['weight_column_name_by_entity_key_plural']
+        self.year = manifest['year']
+
+        variable_by_name_by_simulation_type = manifest['simulations']
+        if 'reference' in variable_by_name_by_simulation_type:
+            self.reference_simulation = CubeSimulation(directory, variable_by_name_by_simulation_type['reference'])
+        if 'reform' in variable_by_name_by_simulation_type and (
+                variable_by_name_by_simulation_type['reform'] != variable_by_name_by_simulation_type.get('reference')):
+            self.reform_simulation = CubeSimulation(directory, variable_by_name_by_simulation_type['reform'])
+        else:
+            # Without reform, both simulation types share the same simulation, as in Aggregates
+            self.reform_simulation = self.reference_simulation
+
+    def compute_preview_aggregates(self, *args, **kwargs):
+        raise NotImplementedError("Previews need the survey data and are not available from the cube {}".format(
+            self.directory))
+
+    def compute_simulation_aggregates(self, simulation_type, reference_data_frame = None):
+        for option in ('memory_budget', 'monthly', 'reuse_unaffected_aggregates'):
+            assert not getattr(self, option), "{} needs the simulations and is not available from the cube {}".format(
+                option, self.directory)
+        return super(CubeAggregates, self).compute_simulation_aggregates(simulation_type,
+            reference_data_frame = reference_data_frame)
+
+    def load_amounts_from_file(self, filename = None, year = None):
+        '''
+        Loads totals from the cube
+        '''
+        if filename is None:
+            filename = os.path.join(self.directory, 'actual.csv')
+        if os.path.exists(filename):
+            self.totals_df = pandas.read_csv(filename, index_col = 0)
+        else:
+            log.info("No administrative data available in cube {}".format(self.directory))
+            self.totals_df = pandas.DataFrame()
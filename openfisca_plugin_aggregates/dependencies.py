@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Dependency graph of the variables, extracted from the source code of their formulas"""
+
+
+import inspect
+import logging
+import re
+
+
+log = logging.getLogger(__name__)
+
+
+calculate_call_re = re.compile(
+    r"""\.(?:calculate|compute)(?:_add)?(?:_divide)?\(\s*(?:variable_name\s*=\s*)?['"](?P<name>\w+)['"]""")
+formula_arguments = ('self', 'simulation', 'period')
+
+
+def get_formula_functions(column):
+    """
+    Returns the Python functions of the formulas of a column, including the dated ones
+    """
+    formula_class = getattr(column, 'formula_class', None)
+    if formula_class is None:
+        return list()
+    functions = list()
+    function = getattr(formula_class, 'function', None)
+    if function is not None:
+        functions.append(function)
+    for dated_formula_class in getattr(formula_class, 'dated_formulas_class', None) or list():
+        function = getattr(dated_formula_class['formula_class'], 'function', None)
+        if function is not None:
+            functions.append(function)
+    return functions
+
+
+def get_variable_dependencies(column, column_by_name):
+    """
+    Returns the names of the variables directly used by the formulas of a column
+    """
+    dependencies = set()
+    formula_class = getattr(column, 'formula_class', None)
+    # Formulas converting a variable from an entity to another one
+    variable_name = getattr(formula_class, 'variable_name', None)
+    if variable_name is not None:
+        dependencies.add(variable_name)
+    for function in get_formula_functions(column):
+        function = getattr(function, 'im_func', function)
+        # Old style formulas receive their input variables as arguments
+        dependencies.update(
+            argument
+            for argument in inspect.getargspec(function).args
+            if argument not in formula_arguments
+            )
+        try:
+            source = inspect.getsource(function)
+        except (IOError, TypeError):
+            log.info("Source of the formula of {} is not available".format(column.name))
+            continue
+        dependencies.update(match.group('name') for match in calculate_call_re.finditer(source))
+    dependencies.discard(column.name)
+    return set(name for name in dependencies if name in column_by_name)
+
+
+def build_dependency_graph(column_by_name, variables):
+    """
+    Returns the direct dependencies of the given variables and of all the variables they use
+    """
+    dependencies_by_name = dict()
+    remaining = list(variables)
+    while remaining:
+        name = remaining.pop()
+        if name in dependencies_by_name or name not in column_by_name:
+            continue
+        dependencies_by_name[name] = get_variable_dependencies(column_by_name[name], column_by_name)
+        remaining.extend(dependencies_by_name[name])
+    return dependencies_by_name
+
+
+def get_transitive_dependencies(dependencies_by_name, variable, transitive_dependencies_by_name = None):
+    """
+    Returns the variable and all the variables it uses, directly or not
+    """
+    if transitive_dependencies_by_name is not None and variable in transitive_dependencies_by_name:
+        return transitive_dependencies_by_name[variable]
+    visited = set()
+    remaining = [variable]
+    while remaining:
+        name = remaining.pop()
+        if name in visited:
+            continue
+        visited.add(name)
+        remaining.extend(dependencies_by_name.get(name, ()))
+    if transitive_dependencies_by_name is not None:
+        transitive_dependencies_by_name[variable] = visited
+    return visited
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Memory budget of the simulation intermediates computed while aggregating"""
+
+
+from __future__ import division
+
+import logging
+import resource
+
+from .dependencies import build_dependency_graph, get_transitive_dependencies
+
+
+log = logging.getLogger(__name__)
+
+
+def get_holder_nbytes(holder):
+    """
+    Returns the number of bytes of the arrays held by a holder
+    """
+    nbytes = 0
+    array = getattr(holder, '_array', None)
+    if array is not None:
+        nbytes += getattr(array, 'nbytes', 0)
+    for array in (getattr(holder, '_array_by_period', None) or dict()).itervalues():
+        nbytes += getattr(array, 'nbytes', 0)
+    return nbytes
+
+
+def get_peak_resident_bytes():
+    """
+    Returns the peak resident memory of the process, since the last reset_peak_resident_bytes if it succeeded
+    """
+    try:
+        with open('/proc/self/status') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    # ru_maxrss is given in kilobytes on Linux and is never reset
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_resident_bytes():
+    """
+    Resets the peak resident memory of the process to its current resident memory (Linux only)
+
+    Returns whether the peak has been reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs_file:
+            clear_refs_file.write('5')
+    except IOError:
+        return False
+    return True
+
+
+def order_variables(variables, transitive_dependencies_by_name):
+    """
+    Orders the variables so that each one shares as many intermediates as possible with the previous ones
+    """
+    remaining = list(variables)
+    computed = set()
+    ordered_variables = list()
+    while remaining:
+        variable = max(
+            remaining,
+            key = lambda name: len(transitive_dependencies_by_name[name] & computed) / (
+                len(transitive_dependencies_by_name[name]) or 1),
+            )
+        remaining.remove(variable)
+        ordered_variables.append(variable)
+        computed |= transitive_dependencies_by_name[variable]
+    return ordered_variables
+
+
+class MemoryManager(object):
+    """
+    Keeps the arrays held by a simulation under a memory budget while aggregating a list of variables
+
+    Holders filled before the manager is created (input data, weights...) and protected variables are never evicted.
+    The other holders are evicted as soon as no remaining variable needs them, then, while the budget is exceeded, by
+    decreasing distance to their next use.
+
+    The report gives the peak of the bytes held by the holders, measured once each variable is computed and before
+    any eviction (holders only grow while a variable is computed, but the temporary arrays of the formulas are not
+    counted), and the peak resident memory of the process during the phase, or during the whole process life where it
+    can't be reset (see peak_resident_scope).
+    """
+    budget = None
+    evicted_bytes = 0
+    peak_holders_bytes = 0
+    peak_resident_reset = False
+    simulation = None
+    variables = None
+
+    def __init__(self, simulation, variables, budget = None, protected_variables = None):
+        self.simulation = simulation
+        self.budget = budget
+        column_by_name = simulation.tax_benefit_system.column_by_name
+        dependencies_by_name = build_dependency_graph(column_by_name, variables)
+        self.transitive_dependencies_by_name = dict()
+        for variable in variables:
+            get_transitive_dependencies(dependencies_by_name, variable, self.transitive_dependencies_by_name)
+        self.variables = order_variables(variables, self.transitive_dependencies_by_name)
+        self.protected_variables = set(protected_variables or list())
+        self.protected_variables.update(
+            name
+            for name, holder in simulation.holder_by_name.iteritems()
+            if get_holder_nbytes(holder) > 0
+            )
+        self.peak_resident_reset = reset_peak_resident_bytes()
+        self.remaining_variables = list(self.variables)
+
+    def get_resident_bytes(self):
+        return sum(get_holder_nbytes(holder) for holder in self.simulation.holder_by_name.itervalues())
+
+    def release(self, variable):
+        """
+        Evicts the holders that are not needed anymore once the variable has been aggregated
+        """
+        self.remaining_variables.remove(variable)
+        resident_bytes = self.get_resident_bytes()
+        self.peak_holders_bytes = max(self.peak_holders_bytes, resident_bytes)
+
+        next_use_by_name = dict()
+        for position, remaining_variable in enumerate(self.remaining_variables):
+            for name in self.transitive_dependencies_by_name[remaining_variable]:
+                next_use_by_name.setdefault(name, position)
+
+        evictable_holders = [
+            (name, holder)
+            for name, holder in self.simulation.holder_by_name.iteritems()
+            if name not in self.protected_variables and get_holder_nbytes(holder) > 0
+            ]
+        # Holders not needed anymore first, then by decreasing distance to their next use
+        evictable_holders.sort(key = lambda item: -next_use_by_name.get(item[0], len(self.remaining_variables)))
+        for name, holder in evictable_holders:
+            if name in next_use_by_name and (self.budget is None or resident_bytes <= self.budget):
+                break
+            nbytes = get_holder_nbytes(holder)
+            holder.delete_arrays()
+            resident_bytes -= nbytes
+            self.evicted_bytes += nbytes
+        return resident_bytes
+
+    def report(self):
+        """
+        Returns the memory usage of the aggregation
+        """
+        return dict(
+            budget = self.budget,
+            evicted_bytes = self.evicted_bytes,
+            peak_holders_bytes = self.peak_holders_bytes,
+            peak_resident_bytes = get_peak_resident_bytes(),
+            peak_resident_scope = 'phase' if self.peak_resident_reset else 'process',
+            resident_holders_bytes = self.get_resident_bytes(),
+            )
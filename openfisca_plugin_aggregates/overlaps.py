@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Overlaps (cumuls) of the beneficiaries of several variables, computed from bit-packed beneficiary masks"""
+
+
+from __future__ import division
+
+import numpy
+import pandas
+
+
+class BeneficiaryMasks(object):
+    """
+    Bit-packed beneficiary masks of variables of the same entity, with the entity weights
+    """
+    chunk_size = 2 ** 12  # Number of bytes unpacked at once
+    packed_masks = None  # (variables x bytes) array of packed bits
+    size = None  # Number of entities
+    variables = None
+    weights = None
+
+    def __init__(self, weights):
+        self.weights = numpy.asarray(weights, dtype = float)
+        self.size = len(self.weights)
+        self.packed_masks = numpy.zeros((0, (self.size + 7) // 8), dtype = numpy.uint8)
+        self.variables = list()
+
+    def add_mask(self, variable, mask):
+        mask = numpy.asarray(mask, dtype = bool)
+        assert len(mask) == self.size
+        packed_mask = numpy.packbits(mask)[numpy.newaxis]
+        if variable in self.variables:
+            self.packed_masks[self.variables.index(variable)] = packed_mask
+        else:
+            self.packed_masks = numpy.vstack((self.packed_masks, packed_mask))
+            self.variables.append(variable)
+
+    def get_mask(self, variable):
+        """
+        Returns the unpacked beneficiary mask of a variable
+        """
+        return numpy.unpackbits(self.packed_masks[self.variables.index(variable)])[:self.size].astype(bool)
+
+    def get_packed_mask(self, variables):
+        """
+        Returns the packed mask of the entities benefiting from at least one of the variables
+        """
+        if isinstance(variables, basestring):
+            variables = [variables]
+        return numpy.bitwise_or.reduce(self.packed_masks[[self.variables.index(variable) for variable in variables]])
+
+    def iter_unpacked_chunks(self, packed_masks):
+        """
+        Yields the unpacked masks and the weights by chunks of entities
+        """
+        for start in range(0, packed_masks.shape[1], self.chunk_size):
+            stop = min(start + self.chunk_size, packed_masks.shape[1])
+            weights = self.weights[start * 8:stop * 8]
+            # Padding bits of the last byte are dropped
+            yield numpy.unpackbits(packed_masks[:, start:stop], axis = 1)[:, :len(weights)], weights
+
+    def overlap_matrix(self):
+        """
+        Returns the weighted number of entities benefiting from each pair of variables
+        """
+        overlaps = numpy.zeros((len(self.variables), len(self.variables)))
+        for masks, weights in self.iter_unpacked_chunks(self.packed_masks):
+            masks = masks.astype(float)
+            overlaps += (masks * weights).dot(masks.T)
+        return pandas.DataFrame(overlaps, index = self.variables, columns = self.variables)
+
+    def combination_count(self, include, exclude = None):
+        """
+        Returns the weighted number of entities benefiting from all the included variables and none of the excluded
+
+        Each element of include and exclude is a variable name or a list of variable names, meaning any of them.
+        """
+        packed_mask = numpy.full(self.packed_masks.shape[1], 0xFF, dtype = numpy.uint8)
+        for variables in include:
+            packed_mask &= self.get_packed_mask(variables)
+        for variables in exclude or list():
+            packed_mask &= ~self.get_packed_mask(variables)
+        count = 0
+        for mask, weights in self.iter_unpacked_chunks(packed_mask[numpy.newaxis]):
+            count += mask[0].dot(weights)
+        return count
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Mergeable reducers computing the aggregate statistics of a variable
+
+A reducer maps a chunk of entities (values and weights) to a partial state, merges two partial states (merge being
+associative) and finalizes the merged state into the statistic. The same reducer can thus be used on whole arrays, on
+streamed chunks or on partial states computed by several workers.
+
+As pandas sums do, sums skip the nan values.
+"""
+
+
+from __future__ import division
+
+import collections
+
+import numpy
+from numpy import nan
+
+
+class Reducer(object):
+    def finalize(self, state):
+        return state
+
+    def map(self, values, weights):
+        raise NotImplementedError
+
+    def merge(self, state, other_state):
+        raise NotImplementedError
+
+
+class SumReducer(Reducer):
+    """
+    Weighted sum of the values, divided by scale
+    """
+    rounded = False
+    scale = 1
+
+    def __init__(self, scale = 1, rounded = False):
+        self.rounded = rounded
+        self.scale = scale
+
+    def finalize(self, state):
+        total = state / self.scale
+        return int(round(total)) if self.rounded else total
+
+    def map(self, values, weights):
+        return float(numpy.nansum(numpy.multiply(values, weights)))
+
+    def merge(self, state, other_state):
+        return state + other_state
+
+
+class CountReducer(SumReducer):
+    """
+    Weighted number of entities with a non-zero value, divided by scale
+    """
+    def map(self, values, weights):
+        return float(numpy.nansum(numpy.multiply(values != 0, weights)))
+
+
+class ThresholdReducer(SumReducer):
+    """
+    Weighted number of entities whose value is above (or equal to) a threshold, divided by scale
+    """
+    threshold = None
+
+    def __init__(self, threshold, scale = 1, rounded = False):
+        super(ThresholdReducer, self).__init__(scale = scale, rounded = rounded)
+        self.threshold = threshold
+
+    def map(self, values, weights):
+        return float(numpy.nansum(numpy.multiply(values >= self.threshold, weights)))
+
+
+class MeanReducer(Reducer):
+    """
+    Weighted mean of the values, nan values being skipped
+    """
+    def finalize(self, state):
+        total, weight_total = state
+        return total / weight_total if weight_total else nan
+
+    def map(self, values, weights):
+        products = numpy.multiply(values, weights)
+        defined = ~numpy.isnan(products)
+        return float(numpy.sum(products[defined])), float(numpy.sum(numpy.asarray(weights)[defined]))
+
+    def merge(self, state, other_state):
+        return state[0] + other_state[0], state[1] + other_state[1]
+
+
+class MinReducer(Reducer):
+    """
+    Minimal value of the entities with a positive weight
+    """
+    function = numpy.minimum
+
+    def finalize(self, state):
+        return nan if state is None else state
+
+    def map(self, values, weights):
+        values = numpy.asarray(values)[numpy.asarray(weights) > 0]
+        return self.function.reduce(values) if len(values) else None
+
+    def merge(self, state, other_state):
+        if state is None:
+            return other_state
+        if other_state is None:
+            return state
+        return self.function(state, other_state)
+
+
+class MaxReducer(MinReducer):
+    """
+    Maximal value of the entities with a positive weight
+    """
+    function = numpy.maximum
+
+
+def get_default_reducer_by_name():
+    """
+    Returns the reducers of the amount (in millions) and of the number of beneficiaries (in thousands)
+    """
+    return collections.OrderedDict((
+        ('amount', SumReducer(scale = 10 ** 6, rounded = True)),
+        ('beneficiaries', CountReducer(scale = 10 ** 3, rounded = True)),
+        ))
+
+
+def reduce_values(reducer, values, weights, chunk_size = None):
+    """
+    Returns the statistic of the values, mapped by chunks of chunk_size entities (all at once by default)
+    """
+    values = numpy.asarray(values)
+    weights = numpy.asarray(weights)
+    chunk_size = chunk_size or max(len(values), 1)
+    state = None
+    for start in range(0, max(len(values), 1), chunk_size):
+        chunk_state = reducer.map(values[start:start + chunk_size], weights[start:start + chunk_size])
+        state = chunk_state if start == 0 else reducer.merge(state, chunk_state)
+    return reducer.finalize(state)
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Detection of the variables whose values are changed by a reform
+
+The parameters and variables used by a formula are found by a static analysis of its source code. Those used through
+helper functions called by the formula are missed, so that a variable may wrongly be deemed unaffected by a reform.
+"""
+
+
+import inspect
+import logging
+import re
+
+import numpy
+from openfisca_core import formulas
+
+from .dependencies import build_dependency_graph, get_formula_functions, get_transitive_dependencies
+
+
+log = logging.getLogger(__name__)
+
+
+legislation_call_re = re.compile(r"""\blegislation(?:_at)?\([^()]*(?:\([^()]*\)[^()]*)*\)(?P<path>(?:\.\w+)*)""")
+legislation_alias_re = re.compile(
+    r"""\b(?P<alias>\w+)\s*=\s*[\w.]*\blegislation(?:_at)?\([^()]*(?:\([^()]*\)[^()]*)*\)(?P<path>(?:\.\w+)*)""")
+# Old style formulas receive the whole legislation as argument
+legislation_arguments = ('_P', 'law')
+# Base classes of the formula classes, DatedFormula being checked first
+formula_kinds = (formulas.DatedFormula, formulas.SimpleFormula, formulas.EntityToPerson, formulas.PersonToEntity)
+
+
+def are_paths_related(path, other_path):
+    """
+    Tells whether a parameter path is a prefix of the other one, or the other way round
+    """
+    if not path or not other_path:
+        return True
+    return path == other_path or path.startswith(other_path + '.') or other_path.startswith(path + '.')
+
+
+def get_changed_parameters(reference_node, reform_node, path = ''):
+    """
+    Returns the paths of the parameters which differ between two compact legislations
+    """
+    if type(reference_node) is not type(reform_node):
+        return set([path])
+    if hasattr(reference_node, '__dict__'):
+        changed_parameters = set()
+        for key in set(reference_node.__dict__) | set(reform_node.__dict__):
+            if key.startswith('_') or key == 'instant':
+                continue
+            changed_parameters.update(get_changed_parameters(
+                getattr(reference_node, key, None),
+                getattr(reform_node, key, None),
+                '{}.{}'.format(path, key) if path else key,
+                ))
+        return changed_parameters
+    if isinstance(reference_node, dict):
+        if set(reference_node) != set(reform_node):
+            return set([path])
+        return set().union(*[
+            get_changed_parameters(value, reform_node[key], path)
+            for key, value in reference_node.iteritems()
+            ])
+    if isinstance(reference_node, (list, tuple)):
+        if len(reference_node) != len(reform_node):
+            return set([path])
+        return set().union(*[
+            get_changed_parameters(value, reform_value, path)
+            for value, reform_value in zip(reference_node, reform_node)
+            ])
+    try:
+        equal = bool(numpy.all(reference_node == reform_node))
+    except (TypeError, ValueError):
+        equal = False
+    return set() if equal else set([path])
+
+
+def get_matched_path(body, match):
+    """
+    Returns the parameter path matched in a formula body, without the method it calls, such as the calc of a scale
+    """
+    path = match.group('path').lstrip('.')
+    if body[match.end():match.end() + 1] == '(':
+        path = path.rpartition('.')[0]
+    return path
+
+
+def get_formula_kind(formula_class):
+    """
+    Returns the base class of a formula class, None for the input variables
+    """
+    if formula_class is None:
+        return None
+    for formula_kind in formula_kinds:
+        if issubclass(formula_class, formula_kind):
+            return formula_kind
+    return formula_class
+
+
+def get_formula_sources(column):
+    """
+    Returns the source code of the formulas of a column, or None when it is not available
+    """
+    sources = list()
+    for function in get_formula_functions(column):
+        try:
+            sources.append(inspect.getsource(getattr(function, 'im_func', function)))
+        except (IOError, TypeError):
+            return None
+    return sources
+
+
+def get_used_parameters(column):
+    """
+    Returns the paths of the parameters used by the formulas of a column, or None when they can't be determined
+    """
+    used_parameters = set()
+    for function in get_formula_functions(column):
+        function = getattr(function, 'im_func', function)
+        try:
+            source = inspect.getsource(function)
+        except (IOError, TypeError):
+            return None
+        body = source[source.index(':', source.index('def ')) + 1:]
+        path_by_alias = dict(
+            (argument, '')
+            for argument in inspect.getargspec(function).args
+            if argument in legislation_arguments
+            )
+        alias_spans = list()
+        for match in legislation_alias_re.finditer(body):
+            path_by_alias[match.group('alias')] = get_matched_path(body, match)
+            alias_spans.append(match.span())
+        for match in legislation_call_re.finditer(body):
+            if not any(start <= match.start() < end for start, end in alias_spans):
+                used_parameters.add(get_matched_path(body, match))
+        for alias, path in path_by_alias.iteritems():
+            for match in re.finditer(r"\b{}\b(?P<path>(?:\.\w+)*)".format(re.escape(alias)), body):
+                if any(start == match.start() for start, end in alias_spans):
+                    continue
+                alias_path = get_matched_path(body, match)
+                used_parameters.add('.'.join(part for part in (path, alias_path) if part))
+    return used_parameters
+
+
+def is_formula_changed(reference_column, reform_column):
+    """
+    Tells whether the formulas of a column have been changed by the reform
+    """
+    if reform_column is reference_column:
+        return False
+    if get_formula_kind(reform_column.formula_class) is not get_formula_kind(reference_column.formula_class):
+        return True
+    if [
+            (dated_formula_class['start_instant'], dated_formula_class['stop_instant'])
+            for dated_formula_class in getattr(reference_column.formula_class, 'dated_formulas_class', None) or list()
+            ] != [
+            (dated_formula_class['start_instant'], dated_formula_class['stop_instant'])
+            for dated_formula_class in getattr(reform_column.formula_class, 'dated_formulas_class', None) or list()
+            ]:
+        return True
+    reference_sources = get_formula_sources(reference_column)
+    return reference_sources is None or reference_sources != get_formula_sources(reform_column)
+
+
+def get_affected_variables(reference_simulation, reform_simulation, variables):
+    """
+    Returns the variables whose values may differ between the reference and the reform simulations
+
+    A variable is affected when a variable it depends on, or itself, has a formula changed by the reform or uses a
+    parameter changed by the reform. Dependencies through helper functions are missed (see the module docstring).
+    """
+    reference_column_by_name = reference_simulation.tax_benefit_system.column_by_name
+    reform_column_by_name = reform_simulation.tax_benefit_system.column_by_name
+
+    changed_parameters = set()
+    start = reform_simulation.period.start
+    for month in range(reform_simulation.period.size * (12 if reform_simulation.period.unit == u'year' else 1)):
+        instant = start.offset(month, u'month')
+        changed_parameters.update(get_changed_parameters(
+            reference_simulation.legislation_at(instant),
+            reform_simulation.legislation_at(instant),
+            ))
+    log.info("Parameters changed by the reform: {}".format(sorted(changed_parameters)))
+
+    dependencies_by_name = build_dependency_graph(reform_column_by_name, variables)
+    changed_variables = set()
+    for name in dependencies_by_name:
+        reform_column = reform_column_by_name[name]
+        reference_column = reference_column_by_name.get(name)
+        if reference_column is None or is_formula_changed(reference_column, reform_column):
+            changed_variables.add(name)
+            continue
+        if changed_parameters:
+            used_parameters = get_used_parameters(reform_column)
+            if used_parameters is None or any(
+                    are_paths_related(changed_parameter, used_parameter)
+                    for changed_parameter in changed_parameters
+                    for used_parameter in used_parameters
+                    ):
+                changed_variables.add(name)
+    log.info("Variables changed by the reform: {}".format(sorted(changed_variables)))
+
+    transitive_dependencies_by_name = dict()
+    return set(
+        variable
+        for variable in variables
+        if variable not in reform_column_by_name or get_transitive_dependencies(
+            dependencies_by_name, variable, transitive_dependencies_by_name) & changed_variables
+        )
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Stratified subsamples of survey households used to preview aggregates"""
+
+
+from __future__ import division
+
+import collections
+import hashlib
+
+import numpy
+
+
+StratifiedSample = collections.namedtuple('StratifiedSample', [
+    'ids',  # Ids of the sampled households, sorted
+    'strata',  # Stratum of each sampled household
+    'population',  # Number of households by stratum
+    'sample_size',  # Number of sampled households by stratum
+    ])
+
+# Samples are drawn once by survey (households and their weights), fraction, strata_count and seed, and shared by all
+# the reforms and legislation years
+stratified_sample_by_key = dict()
+
+
+def draw_stratified_sample(ids, weights, fraction, strata_count = 10, seed = 0):
+    """
+    Draws a stratified sample of households, strata being quantiles of the weights
+
+    At least two households are drawn in each stratum, so that its variance can be estimated.
+    """
+    ids = numpy.asarray(ids)
+    weights = numpy.asarray(weights)
+    size = len(ids)
+    assert size == len(weights)
+    assert 0 < fraction <= 1
+    strata_count = max(1, min(strata_count, size))
+    strata = numpy.empty(size, dtype = int)
+    strata[numpy.argsort(weights, kind = 'mergesort')] = numpy.arange(size) * strata_count // size
+
+    random_state = numpy.random.RandomState(seed)
+    positions = list()
+    for stratum in range(strata_count):
+        members = numpy.flatnonzero(strata == stratum)
+        count = min(len(members), max(2, int(round(fraction * len(members)))))
+        positions.append(random_state.choice(members, count, replace = False))
+    positions = numpy.concatenate(positions)
+    positions = positions[numpy.argsort(ids[positions], kind = 'mergesort')]
+
+    return StratifiedSample(
+        ids = ids[positions],
+        strata = strata[positions],
+        population = numpy.bincount(strata, minlength = strata_count),
+        sample_size = numpy.bincount(strata[positions], minlength = strata_count),
+        )
+
+
+def estimate_total(sample, household_values):
+    """
+    Returns the estimated total and its standard error
+
+    household_values are the sampled households' values already multiplied by their expanded weights, in the order of
+    sample.ids.
+    """
+    household_values = numpy.asarray(household_values, dtype = float)
+    population = sample.population.astype(float)
+    sample_size = sample.sample_size.astype(float)
+    # Values weighted by the initial weights
+    values = household_values / get_expansions(sample)[sample.strata]
+    strata_count = len(population)
+    value_sum = numpy.bincount(sample.strata, weights = values, minlength = strata_count)
+    square_sum = numpy.bincount(sample.strata, weights = values ** 2, minlength = strata_count)
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        variance_by_stratum = numpy.where(
+            sample_size > 1,
+            (square_sum - value_sum ** 2 / sample_size) / (sample_size - 1),
+            0,
+            )
+        variance = numpy.where(
+            sample_size > 0,
+            population ** 2 * (1 - sample_size / population) * variance_by_stratum / sample_size,
+            0,
+            ).sum()
+    return household_values.sum(), numpy.sqrt(max(variance, 0))
+
+
+def get_expansions(sample):
+    """
+    Returns the expansion factor of the weights of each stratum
+    """
+    return sample.population / numpy.maximum(sample.sample_size, 1)
+
+
+def get_stratified_sample(ids, weights, fraction, strata_count = 10, seed = 0, sampling_unit = None):
+    """
+    Returns the cached stratified sample of the households, drawing it if needed
+
+    The cache is keyed by the content of ids and weights, so that a survey is sampled once whatever the legislation
+    year and two surveys never share a sample.
+    """
+    ids = numpy.ascontiguousarray(ids)
+    weights = numpy.ascontiguousarray(weights)
+    survey_hash = hashlib.sha1(ids.tobytes())
+    survey_hash.update(weights.tobytes())
+    key = (survey_hash.hexdigest(), sampling_unit, fraction, strata_count, seed)
+    if key not in stratified_sample_by_key:
+        stratified_sample_by_key[key] = draw_stratified_sample(ids, weights, fraction, strata_count = strata_count,
+            seed = seed)
+    return stratified_sample_by_key[key]
+
+
+def subsample_input_data_frame(input_data_frame, sample, household_id_column, id_columns = None,
+        weight_columns = None):
+    """
+    Returns the rows of the sampled households with renumbered entity ids and expanded weights
+
+    Parameters
+    ----------
+    input_data_frame : DataFrame
+                       persons' input data frame of the survey scenario
+    sample : StratifiedSample
+             sampled households
+    household_id_column : string
+                          name of the column holding the household id of each person
+    id_columns : list
+                 names of the other entity id columns to renumber
+    weight_columns : list
+                     names of the weight columns to expand
+    """
+    selected, household_positions = select_sampled_rows(input_data_frame, sample, household_id_column)
+    data_frame = input_data_frame.loc[selected].copy()
+    expansions = get_expansions(sample)
+    for column in weight_columns or list():
+        data_frame[column] = data_frame[column].values * expansions[sample.strata[household_positions]]
+    data_frame[household_id_column] = household_positions
+    for column in id_columns or list():
+        data_frame[column] = numpy.unique(data_frame[column].values, return_inverse = True)[1]
+    data_frame.reset_index(drop = True, inplace = True)
+    return data_frame
+
+
+def select_sampled_rows(input_data_frame, sample, household_id_column):
+    """
+    Returns the mask of the rows of the sampled households and the position in the sample of their households
+    """
+    household_ids = input_data_frame[household_id_column].values
+    household_positions = numpy.minimum(numpy.searchsorted(sample.ids, household_ids), len(sample.ids) - 1)
+    selected = sample.ids[household_positions] == household_ids
+    return selected, household_positions[selected]
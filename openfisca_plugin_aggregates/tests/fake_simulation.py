@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Minimal simulation and survey scenario, holding given arrays, to test the aggregates without any survey data"""
+
+
+import numpy
+
+from openfisca_plugin_aggregates.aggregates import Aggregates
+
+
+class FakeColumn(object):
+    entity_key_plural = None
+    formula_class = None
+    is_permanent = False
+    label = None
+    name = None
+
+    def __init__(self, name, entity_key_plural, formula_class = None):
+        self.entity_key_plural = entity_key_plural
+        self.formula_class = formula_class
+        self.label = name
+        self.name = name
+
+
+class FakeEntityClass(object):
+    index_for_person_variable_name = None
+    is_persons_entity = False
+
+    def __init__(self, index_for_person_variable_name, is_persons_entity = False):
+        self.index_for_person_variable_name = index_for_person_variable_name
+        self.is_persons_entity = is_persons_entity
+
+
+class FakeTaxBenefitSystem(object):
+    column_by_name = None
+    entity_class_by_key_plural = None
+
+    def __init__(self, column_by_name, entity_class_by_key_plural = None):
+        self.column_by_name = column_by_name
+        self.entity_class_by_key_plural = entity_class_by_key_plural
+
+
+class FakeInstant(object):
+    def __init__(self, year, month = 1):
+        self.month = month
+        self.year = year
+
+    def offset(self, offset, unit):
+        assert unit == u'month'
+        return FakeInstant(self.year, self.month + offset)
+
+    def period(self, unit):
+        assert unit == u'month'
+        return (self.year, self.month)
+
+
+class FakePeriod(object):
+    size = 1
+    unit = u'year'
+
+    def __init__(self, year):
+        self.start = FakeInstant(year)
+
+
+class FakeHolder(object):
+    _array = None
+    _array_by_period = None
+
+    def __init__(self):
+        self._array_by_period = dict()
+
+    def delete_arrays(self):
+        self._array = None
+        self._array_by_period = dict()
+
+    def get_array(self, period):
+        return self._array_by_period.get(period)
+
+
+class FakeSimulation(object):
+    """
+    Simulation whose variables are given arrays, monthly ones being summed by calculate_add
+
+    The arrays of the computed variables are held by holders, as in a real simulation. Months whose array is None are
+    not computed, as the months not covered by a dated formula.
+    """
+    array_by_name = None
+    calculated_variables = None
+    holder_by_name = None
+    legislation = None
+    monthly_arrays_by_name = None
+    period = None
+    tax_benefit_system = None
+
+    def __init__(self, column_by_name, array_by_name, monthly_arrays_by_name = None, year = 2013, legislation = None):
+        self.array_by_name = array_by_name
+        self.calculated_variables = list()
+        self.holder_by_name = dict()
+        self.legislation = legislation
+        self.monthly_arrays_by_name = monthly_arrays_by_name or dict()
+        self.period = FakePeriod(year)
+        self.tax_benefit_system = FakeTaxBenefitSystem(column_by_name)
+
+    def calculate(self, column_name):
+        holder = self.get_or_new_holder(column_name)
+        if holder._array is None:
+            self.calculated_variables.append(column_name)
+            monthly_arrays = self.monthly_arrays_by_name.get(column_name)
+            if monthly_arrays is None:
+                holder._array = numpy.asarray(self.array_by_name[column_name])
+            else:
+                computed_arrays = list()
+                for month, array in enumerate(monthly_arrays):
+                    if array is not None:
+                        holder._array_by_period[self.period.start.offset(month, u'month').period(u'month')] = array
+                        computed_arrays.append(array)
+                holder._array = numpy.sum(computed_arrays, axis = 0)
+        return holder._array
+
+    calculate_add = calculate
+
+    def get_or_new_holder(self, column_name):
+        return self.holder_by_name.setdefault(column_name, FakeHolder())
+
+    def legislation_at(self, instant):
+        return self.legislation
+
+
+class FakeSurveyScenario(object):
+    reference_simulation = None
+    reference_tax_benefit_system = None
+    simulation = None
+    weight_column_name_by_entity_key_plural = None
+    year = None
+
+    def __init__(self, simulation, reference_simulation = None, weight_column_name_by_entity_key_plural = None):
+        self.simulation = simulation
+        if reference_simulation is not None:
+            self.reference_simulation = reference_simulation
+            self.reference_tax_benefit_system = reference_simulation.tax_benefit_system
+        self.weight_column_name_by_entity_key_plural = weight_column_name_by_entity_key_plural or dict(
+            familles = 'weight_familles')
+        self.year = simulation.period.start.year
+
+
+class FakeDataFrameSurveyScenario(object):
+    """
+    Survey scenario whose simulation holds the columns of its persons' input data frame
+
+    The values of the entities other than persons are those of their first member, entities being ordered by id.
+    """
+    input_data_frame = None
+    reference_simulation = None
+    reference_tax_benefit_system = None
+    simulation = None
+    tax_benefit_system = None
+    weight_column_name_by_entity_key_plural = dict(
+        familles = 'weight_familles',
+        individus = 'weight_individus',
+        menages = 'wprm',
+        )
+    year = None
+
+    def init_from_data_frame(self, input_data_frame = None, tax_benefit_system = None,
+            reference_tax_benefit_system = None, year = None):
+        assert reference_tax_benefit_system is None
+        self.input_data_frame = input_data_frame
+        self.tax_benefit_system = tax_benefit_system
+        self.year = year
+        array_by_name = dict()
+        for name, column in tax_benefit_system.column_by_name.iteritems():
+            entity_class = tax_benefit_system.entity_class_by_key_plural[column.entity_key_plural]
+            if entity_class.is_persons_entity:
+                array_by_name[name] = input_data_frame[name].values
+            else:
+                array_by_name[name] = input_data_frame.groupby(entity_class.index_for_person_variable_name)[
+                    name].first().values
+        self.simulation = FakeSimulation(tax_benefit_system.column_by_name, array_by_name, year = year)
+        self.simulation.tax_benefit_system = tax_benefit_system
+        return self
+
+
+def create_aggregates(varlist, array_by_name, reform_array_by_name = None, filter_by = None,
+        monthly_arrays_by_name = None):
+    """
+    Returns the aggregates of fake simulations whose variables, all of the familles entity, are given arrays
+    """
+    def create_simulation(array_by_name):
+        column_by_name = dict(
+            (name, FakeColumn(name, 'familles'))
+            for name in set(array_by_name) | set(monthly_arrays_by_name or dict())
+            )
+        return FakeSimulation(column_by_name, array_by_name, monthly_arrays_by_name = monthly_arrays_by_name)
+
+    reference_simulation = create_simulation(array_by_name)
+    if reform_array_by_name is None:
+        survey_scenario = FakeSurveyScenario(reference_simulation)
+    else:
+        survey_scenario = FakeSurveyScenario(create_simulation(reform_array_by_name),
+            reference_simulation = reference_simulation)
+    aggregates = Aggregates(survey_scenario = survey_scenario)
+    aggregates.filter_by = filter_by
+    aggregates.varlist = varlist
+    return aggregates
@@ -23,10 +23,16 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import numpy
+import pandas
+
 from openfisca_france_data.tests import base
 from openfisca_france_data.surveys import SurveyScenario
 from openfisca_france_data.input_data_builders import get_input_data_frame
 from openfisca_plugin_aggregates.aggregates import Aggregates
+from openfisca_plugin_aggregates.sampling import get_expansions, get_stratified_sample
+from openfisca_plugin_aggregates.tests.fake_simulation import (create_aggregates, FakeColumn,
+    FakeDataFrameSurveyScenario, FakeEntityClass, FakeTaxBenefitSystem)
 
 
 def create_survey_scenario(year = None):
@@ -48,6 +54,154 @@ def test_aggregates(year = 2009):
     return aggregates.base_data_frame
 
 
+def test_monthly_aggregates():
+    aggregates = create_aggregates(
+        ['af', 'cf'],
+        dict(cf = numpy.array([0, 1e3, 2e3]), weight_familles = numpy.array([1e3, 2e3, 3e3])),
+        # af is paid to the first family from July
+        monthly_arrays_by_name = dict(
+            af = [numpy.array([0, 130.4e3, 0])] * 6 + [numpy.array([130.4e3, 130.4e3, 0])] * 6,
+            ),
+        )
+    aggregates.monthly = True
+    data_frame = aggregates.compute_simulation_aggregates('reference')
+    assert data_frame.get_value('af', 'reference_amount') == 3912
+    # Monthly statistics are rounded like the annual ones
+    assert data_frame.get_value('af', 'reference_amount_01') == 261  # 260.8 M€
+    assert data_frame.get_value('af', 'reference_amount_12') == 391  # 391.2 M€
+    assert data_frame.get_value('af', 'reference_beneficiaries_06') == 2
+    assert data_frame.get_value('af', 'reference_beneficiaries_07') == 3
+    # cf is computed on a yearly basis
+    assert data_frame.get_value('cf', 'reference_amount') == 8
+    assert numpy.isnan(data_frame.get_value('cf', 'reference_amount_01'))
+    assert numpy.isnan(data_frame.get_value('cf', 'reference_beneficiaries_12'))
+
+
+def test_monthly_aggregates_of_partial_year():
+    aggregates = create_aggregates(
+        ['af', 'ars'],
+        dict(weight_familles = numpy.array([1e3, 2e3, 3e3])),
+        # A dated formula starting in July: the first months are not computed
+        monthly_arrays_by_name = dict(
+            af = [None] * 6 + [numpy.array([100e3, 0, 200e3])] * 6,
+            ars = [None] * 7 + [numpy.array([0, 0, 300e3])] + [None] * 4,
+            ),
+        )
+    aggregates.reference_simulation.tax_benefit_system.column_by_name['ars'].is_permanent = True
+    aggregates.monthly = True
+    data_frame = aggregates.compute_simulation_aggregates('reference')
+    assert data_frame.get_value('af', 'reference_amount') == 4200
+    assert data_frame.get_value('af', 'reference_amount_06') == 0
+    assert data_frame.get_value('af', 'reference_amount_07') == 700
+    assert data_frame.get_value('af', 'reference_beneficiaries_01') == 0
+    assert data_frame.get_value('af', 'reference_beneficiaries_12') == 4
+    # The array of a permanent variable is the same for every month
+    assert data_frame.get_value('ars', 'reference_amount') == 900
+    assert numpy.isnan(data_frame.get_value('ars', 'reference_amount_08'))
+
+
+def test_pipelined_aggregates(size = 1000, variable_count = 10):
+    random_state = numpy.random.RandomState(0)
+    array_by_name = dict(
+        ('variable_{}'.format(index), random_state.exponential(1000, size) * (random_state.uniform(size = size) < .3))
+        for index in range(variable_count)
+        )
+    array_by_name['weight_familles'] = random_state.uniform(100, 1000, size)
+    array_by_name['champm_familles'] = random_state.uniform(size = size) < .9
+    varlist = sorted(name for name in array_by_name if name.startswith('variable_'))
+
+    serial_data_frame = create_aggregates(varlist, array_by_name, filter_by = 'champm').compute_simulation_aggregates(
+        'reference')
+    aggregates = create_aggregates(varlist, array_by_name, filter_by = 'champm')
+    aggregates.pipeline_queue_size = 1
+    aggregates.pipeline_workers = 2
+    pipelined_data_frame = aggregates.compute_simulation_aggregates('reference')
+    assert pipelined_data_frame.equals(serial_data_frame), (pipelined_data_frame, serial_data_frame)
+
+
+def create_preview_aggregates(household_count = 200):
+    """
+    Returns the aggregates of a survey of households of two persons, forming one or two families
+    """
+    random_state = numpy.random.RandomState(0)
+    idmen = numpy.repeat(numpy.arange(household_count), 2)
+    # Even households hold two families
+    idfam = numpy.unique(idmen * 2 + (idmen % 2 == 0) * numpy.tile([0, 1], household_count),
+        return_inverse = True)[1]
+    input_data_frame = pandas.DataFrame(dict(
+        af = random_state.choice([0, 130.], size = idfam.max() + 1)[idfam],
+        idfam = idfam,
+        idmen = idmen,
+        salaire = random_state.exponential(20e3, size = len(idmen)),
+        weight_familles = random_state.uniform(500, 1500, size = idfam.max() + 1)[idfam],
+        weight_individus = random_state.uniform(500, 1500, size = len(idmen)),
+        wprm = random_state.uniform(500, 1500, size = household_count)[idmen],
+        ))
+    column_by_name = dict(
+        af = FakeColumn('af', 'familles'),
+        salaire = FakeColumn('salaire', 'individus'),
+        weight_familles = FakeColumn('weight_familles', 'familles'),
+        weight_individus = FakeColumn('weight_individus', 'individus'),
+        wprm = FakeColumn('wprm', 'menages'),
+        )
+    entity_class_by_key_plural = dict(
+        familles = FakeEntityClass('idfam'),
+        individus = FakeEntityClass('noindiv', is_persons_entity = True),
+        menages = FakeEntityClass('idmen'),
+        )
+    survey_scenario = FakeDataFrameSurveyScenario().init_from_data_frame(
+        input_data_frame = input_data_frame,
+        tax_benefit_system = FakeTaxBenefitSystem(column_by_name, entity_class_by_key_plural),
+        year = 2013,
+        )
+    aggregates = Aggregates(survey_scenario = survey_scenario)
+    aggregates.filter_by = None
+    aggregates.varlist = ['af', 'salaire']
+    return aggregates
+
+
+def test_preview_aggregates():
+    aggregates = create_preview_aggregates()
+    simulation = aggregates.reference_simulation
+    preview_data_frame = aggregates.compute_preview_aggregates(fraction = 1, strata_count = 4, reform = False)
+    for variable, weight in (('af', 'weight_familles'), ('salaire', 'weight_individus')):
+        values = simulation.calculate(variable)
+        weights = simulation.calculate(weight)
+        assert numpy.isclose(preview_data_frame.reference_amount[variable], (values * weights).sum() / 10 ** 6)
+        assert numpy.isclose(preview_data_frame.reference_beneficiaries[variable],
+            ((values != 0) * weights).sum() / 10 ** 3)
+        assert preview_data_frame.reference_amount_standard_error[variable] == 0
+        assert preview_data_frame.reference_beneficiaries_standard_error[variable] == 0
+
+
+def test_preview_aggregates_with_calibrated_weights(fraction = .3):
+    aggregates = create_preview_aggregates()
+    simulation = aggregates.reference_simulation
+    input_data_frame = aggregates.survey_scenario.input_data_frame
+    random_state = numpy.random.RandomState(1)
+    for entity_key_plural, weight in (('familles', 'weight_familles'), ('individus', 'weight_individus')):
+        weights = simulation.calculate(weight)
+        aggregates.weight_by_entity_key_plural[entity_key_plural] = weights * random_state.uniform(.5, 2,
+            size = len(weights))
+    preview_data_frame = aggregates.compute_preview_aggregates(fraction = fraction, strata_count = 4, reform = False)
+
+    # Expected totals of the sampled households, weighted by their expanded calibrated weights
+    household_weights = input_data_frame.groupby('idmen').wprm.first()
+    sample = get_stratified_sample(household_weights.index.values, household_weights.values, fraction,
+        strata_count = 4, sampling_unit = 'menages')
+    sampled = numpy.in1d(input_data_frame.idmen.values, sample.ids)
+    expansions = get_expansions(sample)[sample.strata[numpy.searchsorted(sample.ids, input_data_frame.idmen.values[
+        sampled])]]
+    family_positions, first_members = numpy.unique(input_data_frame.idfam.values[sampled], return_index = True)
+    af_amount = (simulation.calculate('af')[family_positions] * aggregates.weight_by_entity_key_plural['familles'][
+        family_positions] * expansions[first_members]).sum()
+    salaire_amount = (simulation.calculate('salaire')[sampled] * aggregates.weight_by_entity_key_plural[
+        'individus'][sampled] * expansions).sum()
+    assert numpy.isclose(preview_data_frame.reference_amount['af'], af_amount / 10 ** 6)
+    assert numpy.isclose(preview_data_frame.reference_amount['salaire'], salaire_amount / 10 ** 6)
+    assert preview_data_frame.reference_amount_standard_error['salaire'] > 0
+
+
 if __name__ == '__main__':
     import logging
     log = logging.getLogger(__name__)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import os
+import shutil
+import tempfile
+
+import pandas
+
+from openfisca_plugin_aggregates import batch
+from openfisca_plugin_aggregates.batch import (get_checkpoint_path, get_units, load_job_spec, run_job,
+    save_checkpoint)
+
+
+def test_run_job_resumes_from_checkpoints():
+    output_directory = tempfile.mkdtemp()
+    try:
+        job_spec_path = os.path.join(output_directory, 'job.json')
+        with open(job_spec_path, 'w') as job_spec_file:
+            json.dump(dict(years = [2013], reforms = dict(plf2015 = 'openfisca_france.reforms.plf2015'),
+                output_directory = output_directory), job_spec_file)
+        job_spec = load_job_spec(job_spec_path)
+        assert get_units(job_spec) == [(2013, None, 'reference'), (2013, 'plf2015', 'reform')]
+
+        os.makedirs(os.path.join(output_directory, 'checkpoints'))
+        save_checkpoint(job_spec, (2013, None, 'reference'), pandas.DataFrame(
+            dict(entity = ['fam'], label = ['af'], reference_amount = [12000], reference_beneficiaries = [4800]),
+            index = ['af']))
+        save_checkpoint(job_spec, (2013, 'plf2015', 'reform'), pandas.DataFrame(
+            dict(reform_amount = [12100], reform_beneficiaries = [4800]), index = ['af']))
+        # Every unit has a checkpoint: nothing is computed again
+        assert run_job(job_spec) == []
+        assert os.path.exists(get_checkpoint_path(job_spec, (2013, 'plf2015', 'reform')))
+        data_frame = pandas.read_csv(os.path.join(output_directory, 'aggregates_2013_plf2015.csv'), index_col = 0)
+        assert data_frame.get_value('af', 'reform_amount') == 12100
+    finally:
+        shutil.rmtree(output_directory)
+
+
+def test_run_job_computes_missing_units():
+    output_directory = tempfile.mkdtemp()
+    computed_units = list()
+
+    def compute_unit(job_spec, unit):
+        computed_units.append(unit)
+        simulation_type = unit[2]
+        save_checkpoint(job_spec, unit, pandas.DataFrame(
+            {'{}_amount'.format(simulation_type): [len(computed_units)]}, index = ['af']))
+
+    compute_unit_backup = batch.compute_unit
+    batch.compute_unit = compute_unit
+    try:
+        job_spec = dict(batch.default_job_spec, years = [2013], reforms = dict(plf2015 = 'plf2015'),
+            output_directory = output_directory)
+        os.makedirs(os.path.join(output_directory, 'checkpoints'))
+        save_checkpoint(job_spec, (2013, None, 'reference'), pandas.DataFrame(
+            dict(reference_amount = [12000]), index = ['af']))
+        # Only the missing reform unit is computed
+        assert run_job(job_spec) == []
+        assert computed_units == [(2013, 'plf2015', 'reform')]
+        data_frame = pandas.read_csv(os.path.join(output_directory, 'aggregates_2013_plf2015.csv'), index_col = 0)
+        assert data_frame.get_value('af', 'reference_amount') == 12000
+        assert data_frame.get_value('af', 'reform_amount') == 1
+
+        # Checkpoints of another varlist are not reused
+        del computed_units[:]
+        job_spec['varlist'] = ['af', 'cf']
+        assert run_job(job_spec) == []
+        assert computed_units == [(2013, None, 'reference'), (2013, 'plf2015', 'reform')]
+    finally:
+        batch.compute_unit = compute_unit_backup
+        shutil.rmtree(output_directory)
+
+
+def test_get_checkpoint_path():
+    job_spec = dict(batch.default_job_spec, years = [2013], reforms = dict(plf2015 = 'plf2015'))
+    reusing_job_spec = dict(job_spec, reuse_unaffected_aggregates = True)
+    # Only the reform units depend on the reuse of the unaffected reference aggregates
+    assert get_checkpoint_path(job_spec, (2013, None, 'reference')) == get_checkpoint_path(reusing_job_spec,
+        (2013, None, 'reference'))
+    assert get_checkpoint_path(job_spec, (2013, 'plf2015', 'reform')) != get_checkpoint_path(reusing_job_spec,
+        (2013, 'plf2015', 'reform'))
+
+
+if __name__ == '__main__':
+    test_get_checkpoint_path()
+    test_run_job_computes_missing_units()
+    test_run_job_resumes_from_checkpoints()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy
+import pandas
+
+from openfisca_plugin_aggregates.calibration import calibrate_weights
+from openfisca_plugin_aggregates.tests.fake_simulation import create_aggregates
+
+
+def create_margins(size = 1000, seed = 1):
+    random_state = numpy.random.RandomState(seed)
+    initial_weights = random_state.uniform(50, 150, size)
+    amounts = random_state.exponential(1000, size) * (random_state.uniform(size = size) < .3)
+    margin_matrix = numpy.column_stack((amounts, amounts != 0, numpy.ones(size)))
+    targets = margin_matrix.T.dot(initial_weights) * numpy.array([1.1, .95, 1])
+    return margin_matrix, initial_weights, targets
+
+
+def test_calibrate_weights(method = 'raking'):
+    margin_matrix, initial_weights, targets = create_margins()
+    weights, diagnostics = calibrate_weights(margin_matrix, initial_weights, targets, method = method)
+    assert diagnostics['converged'], diagnostics
+    assert numpy.allclose(margin_matrix.T.dot(weights), targets, rtol = 1e-5)
+    if method == 'raking':
+        assert (weights > 0).all()
+
+
+def test_calibrate_weights_linear():
+    test_calibrate_weights(method = 'linear')
+
+
+def create_calibrated_aggregates(actual_amount, actual_beneficiaries):
+    aggregates = create_aggregates(['af'], dict(
+        af = numpy.array([0, 1200, 2400, 0, 1200]),
+        weight_familles = numpy.array([1000., 2000., 3000., 4000., 1000.]),
+        ))
+    aggregates.totals_df = pandas.DataFrame(
+        dict(actual_amount = [actual_amount], actual_beneficiaries = [actual_beneficiaries]), index = ['af'])
+    return aggregates
+
+
+def test_aggregates_calibrate_weights():
+    aggregates = create_calibrated_aggregates(12, 6)
+    diagnostics_by_entity_key_plural = aggregates.calibrate_weights()
+    assert diagnostics_by_entity_key_plural['familles']['converged'], diagnostics_by_entity_key_plural
+    assert numpy.isclose(aggregates.get_weights('reference', 'familles').sum(), 11000)
+    variable_data_frame = aggregates.compute_variable_aggregates('af')
+    assert variable_data_frame.get_value('af', 'reference_amount') == 12
+    assert variable_data_frame.get_value('af', 'reference_beneficiaries') == 6
+
+
+def test_aggregates_calibrate_weights_not_converged():
+    # More beneficiaries than families: the raking can't reach the margins
+    aggregates = create_calibrated_aggregates(12, 20)
+    diagnostics_by_entity_key_plural = aggregates.calibrate_weights()
+    assert not diagnostics_by_entity_key_plural['familles']['converged']
+    assert 'familles' not in aggregates.weight_by_entity_key_plural
+    assert (aggregates.get_weights('reference', 'familles') == [1000, 2000, 3000, 4000, 1000]).all()
+
+
+if __name__ == '__main__':
+    test_aggregates_calibrate_weights()
+    test_aggregates_calibrate_weights_not_converged()
+    test_calibrate_weights()
+    test_calibrate_weights_linear()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import shutil
+import tempfile
+
+import numpy
+import pandas
+
+from openfisca_plugin_aggregates.cube import CubeAggregates
+from openfisca_plugin_aggregates.tests.fake_simulation import create_aggregates
+
+
+def create_fake_aggregates():
+    weights = numpy.array([1000, 2000, 3000, 4000], dtype = numpy.float32)
+    champm = numpy.array([True, True, True, False])
+    aggregates = create_aggregates(
+        ['af', 'cf'],
+        dict(
+            af = numpy.array([0, 1200, 2400, 0], dtype = numpy.float32),
+            cf = numpy.array([0, 0, 1000, 1000], dtype = numpy.float32),
+            champm_familles = champm,
+            weight_familles = weights,
+            ),
+        reform_array_by_name = dict(
+            af = numpy.array([0, 1300, 2600, 0], dtype = numpy.float32),
+            cf = numpy.array([0, 0, 1000, 1000], dtype = numpy.float32),
+            champm_familles = champm,
+            weight_familles = weights,
+            ),
+        filter_by = 'champm',
+        )
+    aggregates.totals_df = pandas.DataFrame()
+    return aggregates
+
+
+def test_export_cube():
+    directory = tempfile.mkdtemp()
+    try:
+        aggregates = create_fake_aggregates()
+        aggregates.export_cube(directory)
+        expected_data_frame = aggregates.compute_aggregates(actual = False)
+
+        cube_aggregates = CubeAggregates(directory)
+        assert cube_aggregates.reform_simulation is not cube_aggregates.reference_simulation
+        base_data_frame = cube_aggregates.compute_aggregates(actual = False)
+        assert base_data_frame.equals(expected_data_frame), (base_data_frame, expected_data_frame)
+        assert base_data_frame.get_value('af', 'reference_amount') == 10  # 1200 * 2000 + 2400 * 3000 = 9.6 M€
+        assert base_data_frame.get_value('af', 'reform_amount') == 10  # 10.4 M€
+        assert base_data_frame.get_value('af', 'reference_beneficiaries') == 5
+
+        # The filter can be changed within the variables of the cube
+        cube_aggregates.filter_by = None
+        assert cube_aggregates.compute_aggregates(actual = False).get_value('cf', 'reference_beneficiaries') == 7
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_export_cube_without_reform():
+    directory = tempfile.mkdtemp()
+    try:
+        create_fake_aggregates().export_cube(directory, simulation_types = ['reference'])
+        cube_aggregates = CubeAggregates(directory)
+        assert cube_aggregates.reform_simulation is cube_aggregates.reference_simulation
+        base_data_frame = cube_aggregates.compute_aggregates()
+        assert base_data_frame.get_value('af', 'reform_amount') == 10
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_cube_unavailable_options():
+    directory = tempfile.mkdtemp()
+    try:
+        create_fake_aggregates().export_cube(directory)
+        for option, value in (('memory_budget', 10 ** 6), ('monthly', True), ('reuse_unaffected_aggregates', True)):
+            cube_aggregates = CubeAggregates(directory)
+            setattr(cube_aggregates, option, value)
+            try:
+                cube_aggregates.compute_aggregates(actual = False)
+            except AssertionError as error:
+                assert option in str(error)
+            else:
+                assert False, "{} should not be available from a cube".format(option)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    test_export_cube()
+    test_export_cube_without_reform()
+    test_cube_unavailable_options()
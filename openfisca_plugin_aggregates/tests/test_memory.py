@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy
+
+from openfisca_plugin_aggregates.memory import MemoryManager, order_variables
+from openfisca_plugin_aggregates.tests.fake_simulation import FakeColumn, FakeSimulation
+
+
+def af_function(self, simulation, period):
+    return simulation.calculate('af_base', period)
+
+
+def apl_function(self, simulation, period):
+    return simulation.calculate('br_al', period)
+
+
+def cf_function(self, simulation, period):
+    return simulation.calculate('af_base', period) + simulation.calculate('br_pf', period)
+
+
+def create_simulation():
+    array_by_name = dict(
+        (name, numpy.zeros(1000))
+        for name in ['af', 'af_base', 'apl', 'br_al', 'br_pf', 'cf', 'weight_familles']
+        )
+    column_by_name = dict((name, FakeColumn(name, 'familles')) for name in array_by_name)
+    for name, function in [('af', af_function), ('apl', apl_function), ('cf', cf_function)]:
+        column_by_name[name].formula_class = type(name, (object,), dict(function = function))
+    return FakeSimulation(column_by_name, array_by_name)
+
+
+def test_memory_manager_release():
+    simulation = create_simulation()
+    simulation.calculate('weight_familles')
+    memory_manager = MemoryManager(simulation, ['af', 'apl', 'cf'])
+    assert memory_manager.variables == ['af', 'cf', 'apl'], memory_manager.variables
+
+    for name in ['af_base', 'af']:
+        simulation.calculate(name)
+    memory_manager.release('af')
+    # af is not needed anymore, af_base is needed by cf
+    assert simulation.holder_by_name['af']._array is None
+    assert simulation.holder_by_name['af_base']._array is not None
+
+    for name in ['br_pf', 'cf']:
+        simulation.calculate(name)
+    memory_manager.release('cf')
+    assert all(
+        simulation.holder_by_name[name]._array is None
+        for name in ['af_base', 'br_pf', 'cf']
+        )
+    # Holders filled before the manager are protected
+    assert simulation.holder_by_name['weight_familles']._array is not None
+    assert memory_manager.report()['peak_holders_bytes'] == 4 * 8000
+
+
+def test_memory_manager_budget():
+    simulation = create_simulation()
+    simulation.calculate('weight_familles')
+    memory_manager = MemoryManager(simulation, ['af', 'apl', 'cf'], budget = 2 * 8000)
+    for name in ['af_base', 'af', 'br_al']:
+        simulation.calculate(name)
+    # af is not needed anymore, then br_al is evicted before af_base, needed sooner
+    assert memory_manager.release('af') == 2 * 8000
+    assert simulation.holder_by_name['af']._array is None
+    assert simulation.holder_by_name['br_al']._array is None
+    assert simulation.holder_by_name['af_base']._array is not None
+    assert simulation.holder_by_name['weight_familles']._array is not None
+
+    memory_manager.budget = 0
+    simulation.calculate('cf')
+    # The protected weights are kept whatever the budget
+    assert memory_manager.release('cf') == 8000
+    assert memory_manager.evicted_bytes == 4 * 8000
+
+
+def test_order_variables():
+    transitive_dependencies_by_name = dict(
+        af = set(['af', 'af_base', 'af_nbenf']),
+        apl = set(['apl', 'aides_logement', 'br_al']),
+        alf = set(['alf', 'aides_logement', 'br_al']),
+        cf = set(['cf', 'af_nbenf', 'br_pf']),
+        )
+    ordered_variables = order_variables(['af', 'apl', 'cf', 'alf'], transitive_dependencies_by_name)
+    assert ordered_variables == ['af', 'cf', 'apl', 'alf'], ordered_variables
+
+
+if __name__ == '__main__':
+    test_memory_manager_budget()
+    test_memory_manager_release()
+    test_order_variables()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy
+from numpy import nan
+import pandas
+
+from openfisca_plugin_aggregates.overlaps import BeneficiaryMasks
+from openfisca_plugin_aggregates.tests.fake_simulation import create_aggregates
+
+
+def test_beneficiary_masks(size = 1001):
+    random_state = numpy.random.RandomState(0)
+    weights = random_state.uniform(100, 200, size)
+    mask_by_variable = dict(
+        (variable, random_state.uniform(size = size) < .3)
+        for variable in ['rsa', 'apl', 'alf', 'als']
+        )
+    beneficiary_masks = BeneficiaryMasks(weights)
+    beneficiary_masks.chunk_size = 16  # Several chunks and a partial last byte
+    for variable in ['rsa', 'apl', 'alf', 'als']:
+        beneficiary_masks.add_mask(variable, mask_by_variable[variable])
+
+    assert (beneficiary_masks.get_mask('apl') == mask_by_variable['apl']).all()
+
+    overlaps = beneficiary_masks.overlap_matrix()
+    for variable in ['rsa', 'apl', 'alf', 'als']:
+        for other_variable in ['rsa', 'apl', 'alf', 'als']:
+            assert numpy.isclose(
+                overlaps.loc[variable, other_variable],
+                (mask_by_variable[variable] & mask_by_variable[other_variable]).dot(weights),
+                )
+
+    housing = mask_by_variable['apl'] | mask_by_variable['alf'] | mask_by_variable['als']
+    assert numpy.isclose(
+        beneficiary_masks.combination_count(['rsa', ['apl', 'alf', 'als']]),
+        (mask_by_variable['rsa'] & housing).dot(weights),
+        )
+    assert numpy.isclose(
+        beneficiary_masks.combination_count(['rsa'], exclude = [['apl', 'alf', 'als']]),
+        (mask_by_variable['rsa'] & ~housing).dot(weights),
+        )
+
+
+def test_overlaps_of_reused_aggregates():
+    weights = numpy.array([1000., 2000., 3000.])
+    aggregates = create_aggregates(
+        ['apl', 'rsa'],
+        dict(apl = numpy.array([100., 0, 200.]), rsa = numpy.array([0, 500., 400.]), weight_familles = weights),
+        reform_array_by_name = dict(apl = numpy.array([100., 0, 200.]), rsa = numpy.array([500., 0, 400.]),
+            weight_familles = weights),
+        )
+    aggregates.keep_beneficiary_masks = True
+    aggregates.reuse_unaffected_aggregates = True
+    aggregates.get_unaffected_variables = lambda: set(['apl'])
+    reference_data_frame = aggregates.compute_simulation_aggregates('reference')
+    aggregates.compute_simulation_aggregates('reform', reference_data_frame = reference_data_frame)
+    assert 'apl' not in aggregates.reform_simulation.calculated_variables
+    overlaps = aggregates.compute_overlaps('familles', simulation_type = 'reform')
+    assert overlaps.loc['apl', 'rsa'] == 4
+    assert aggregates.compute_combination_beneficiaries(['rsa'], exclude = ['apl'], simulation_type = 'reform') == 0
+
+    # Calibrated weights make the beneficiary masks outdated
+    aggregates.totals_df = pandas.DataFrame(dict(actual_amount = [nan], actual_beneficiaries = [5.5]), index = ['rsa'])
+    assert aggregates.calibrate_weights()['familles']['converged']
+    assert aggregates.beneficiary_masks_by_simulation_type == dict()
+
+
+if __name__ == '__main__':
+    test_beneficiary_masks()
+    test_overlaps_of_reused_aggregates()
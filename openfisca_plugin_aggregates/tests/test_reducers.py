@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy
+from numpy import nan
+
+from openfisca_plugin_aggregates.reducers import (CountReducer, MaxReducer, MeanReducer, MinReducer, SumReducer,
+    ThresholdReducer, reduce_values)
+
+
+def test_reducers_by_chunks(size = 1003):
+    random_state = numpy.random.RandomState(0)
+    values = random_state.exponential(1000, size) * (random_state.uniform(size = size) < .4)
+    weights = random_state.uniform(100, 200, size)
+    weights[:10] = 0
+    expected_value_by_reducer = {
+        SumReducer(scale = 10 ** 6): (values * weights).sum() / 10 ** 6,
+        CountReducer(scale = 10 ** 3): ((values != 0) * weights).sum() / 10 ** 3,
+        MeanReducer(): (values * weights).sum() / weights.sum(),
+        MinReducer(): values[10:].min(),
+        MaxReducer(): values[10:].max(),
+        ThresholdReducer(500): ((values >= 500) * weights).sum(),
+        }
+    for reducer, expected_value in expected_value_by_reducer.iteritems():
+        for chunk_size in [None, 1, 7, 100]:
+            assert numpy.isclose(reduce_values(reducer, values, weights, chunk_size = chunk_size), expected_value)
+
+
+def test_merge_is_associative():
+    reducer = MeanReducer()
+    states = [reducer.map(numpy.arange(start, start + 3), numpy.ones(3)) for start in range(0, 9, 3)]
+    assert reducer.merge(reducer.merge(states[0], states[1]), states[2]) == reducer.merge(
+        states[0], reducer.merge(states[1], states[2]))
+    assert reducer.finalize(reducer.merge(reducer.merge(states[0], states[1]), states[2])) == 4
+
+
+def test_nan_values_are_skipped():
+    values = numpy.array([1, nan, 2])
+    weights = numpy.ones(3)
+    assert reduce_values(SumReducer(rounded = True), values, weights) == 3
+    # As in the former pandas based aggregates, nan values are counted as non zero
+    assert reduce_values(CountReducer(), values, weights) == 3
+    assert reduce_values(MeanReducer(), values, weights) == 1.5
+
+
+def test_rounded_sum():
+    assert reduce_values(SumReducer(scale = 10 ** 6, rounded = True), numpy.array([1.4e6, 1e6]), numpy.ones(2)) == 2
+
+
+if __name__ == '__main__':
+    test_merge_is_associative()
+    test_nan_values_are_skipped()
+    test_reducers_by_chunks()
+    test_rounded_sum()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from openfisca_core import formulas
+
+from openfisca_plugin_aggregates.reform_delta import (are_paths_related, get_affected_variables,
+    get_changed_parameters, get_used_parameters, is_formula_changed)
+from openfisca_plugin_aggregates.tests.fake_simulation import FakeColumn, FakeSimulation
+
+
+class Node(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def test_get_changed_parameters():
+    reference_legislation = Node(
+        ir = Node(bareme = Node(rates = [0, .055, .14], thresholds = [0, 6011, 11991]), plaf_qf = 1508),
+        prestations = Node(af = Node(bmaf = .32)),
+        )
+    reform_legislation = Node(
+        ir = Node(bareme = Node(rates = [0, .055, .14], thresholds = [0, 9690, 11991]), plaf_qf = 1508),
+        prestations = Node(af = Node(bmaf = .32)),
+        )
+    assert get_changed_parameters(reference_legislation, reform_legislation) == set(['ir.bareme.thresholds'])
+    assert get_changed_parameters(reference_legislation, reference_legislation) == set()
+
+
+def test_are_paths_related():
+    assert are_paths_related('ir.bareme', 'ir.bareme.thresholds')
+    assert are_paths_related('ir', 'ir.bareme')
+    assert are_paths_related('', 'prestations.af')
+    assert not are_paths_related('ir.bareme', 'ir.bareme_2')
+    assert not are_paths_related('ir.plaf_qf', 'prestations.af')
+
+
+def af_function(self, simulation, period):
+    return simulation.calculate('af_base', period)
+
+
+def af_base_function(self, simulation, period):
+    P = simulation.legislation_at(period.start).fam.af
+    return period, simulation.calculate('af_nbenf', period) * P.bmaf
+
+
+def af_base_reform_function(self, simulation, period):
+    P = simulation.legislation_at(period.start).fam.af
+    return period, simulation.calculate('af_nbenf', period) * P.bmaf * 2
+
+
+def ir_function(self, simulation, period):
+    return period, simulation.legislation_at(period.start).ir.bareme.calc(simulation.calculate('rni', period))
+
+
+def af_majo_function(self, af_nbenf, _P):
+    return af_nbenf * _P.fam.af.maj_age_un_enfant
+
+
+def revdisp_function(self, simulation, period):
+    return period, simulation.calculate('af', period) - simulation.calculate('ir', period)
+
+
+# Formula compiled from a string, whose source can't be read
+exec_namespace = dict()
+exec('def crds_function(self, simulation, period):\n    return period, simulation.calculate("rni", period) * .005\n',
+    exec_namespace)
+crds_function = exec_namespace['crds_function']
+
+
+def create_column(name, function = None):
+    if function is None:
+        return FakeColumn(name, 'familles')
+    formula_class = type(name, (formulas.SimpleFormula,), dict(function = function))
+    return FakeColumn(name, 'familles', formula_class = formula_class)
+
+
+def create_legislation(bmaf = .32, thresholds = None):
+    return Node(
+        fam = Node(af = Node(bmaf = bmaf, maj_age_un_enfant = .16)),
+        ir = Node(bareme = Node(rates = [0, .055, .14], thresholds = thresholds or [0, 6011, 11991])),
+        )
+
+
+def test_is_formula_changed():
+    reference_column = FakeColumn('af', 'familles',
+        formula_class = type('af', (formulas.SimpleFormula,), dict(function = af_function)))
+    assert not is_formula_changed(reference_column, reference_column)
+    assert not is_formula_changed(reference_column, FakeColumn('af', 'familles',
+        formula_class = type('af', (formulas.SimpleFormula,), dict(function = af_function))))
+    assert is_formula_changed(reference_column, FakeColumn('af', 'familles',
+        formula_class = type('af', (formulas.DatedFormula,), dict(dated_formulas_class = list()))))
+    assert is_formula_changed(reference_column, FakeColumn('af', 'familles'))
+
+
+def test_get_used_parameters():
+    assert get_used_parameters(create_column('af_base', af_base_function)) == set(['fam.af.bmaf'])
+    assert get_used_parameters(create_column('ir', ir_function)) == set(['ir.bareme'])
+    assert get_used_parameters(create_column('af_majo', af_majo_function)) == set(['fam.af.maj_age_un_enfant'])
+    assert get_used_parameters(create_column('af', af_function)) == set()
+    assert get_used_parameters(create_column('crds', crds_function)) is None
+
+
+def test_get_affected_variables():
+    column_by_name = dict(
+        af = create_column('af', af_function),
+        af_base = create_column('af_base', af_base_function),
+        af_majo = create_column('af_majo', af_majo_function),
+        af_nbenf = create_column('af_nbenf'),
+        crds = create_column('crds', crds_function),
+        ir = create_column('ir', ir_function),
+        revdisp = create_column('revdisp', revdisp_function),
+        rni = create_column('rni'),
+        )
+    variables = ['af', 'af_majo', 'crds', 'ir', 'revdisp']
+    reference_simulation = FakeSimulation(column_by_name, dict(), legislation = create_legislation())
+
+    # No change
+    reform_simulation = FakeSimulation(column_by_name, dict(), legislation = create_legislation())
+    assert get_affected_variables(reference_simulation, reform_simulation, variables) == set()
+
+    # A changed parameter spreads to the variables using the ones which use it
+    reform_simulation = FakeSimulation(column_by_name, dict(), legislation = create_legislation(bmaf = .4))
+    assert get_affected_variables(reference_simulation, reform_simulation, variables) == set(
+        ['af', 'crds', 'revdisp'])
+    reform_simulation = FakeSimulation(column_by_name, dict(),
+        legislation = create_legislation(thresholds = [0, 9690, 11991]))
+    assert get_affected_variables(reference_simulation, reform_simulation, variables) == set(
+        ['crds', 'ir', 'revdisp'])
+
+    # A changed formula
+    reform_column_by_name = column_by_name.copy()
+    reform_column_by_name['af_base'] = create_column('af_base', af_base_reform_function)
+    reform_simulation = FakeSimulation(reform_column_by_name, dict(), legislation = create_legislation())
+    assert get_affected_variables(reference_simulation, reform_simulation, variables) == set(['af', 'revdisp'])
+
+    # A formula whose source can't be read can't be told unchanged
+    reform_column_by_name = column_by_name.copy()
+    reform_column_by_name['crds'] = create_column('crds', crds_function)
+    reform_simulation = FakeSimulation(reform_column_by_name, dict(), legislation = create_legislation())
+    assert get_affected_variables(reference_simulation, reform_simulation, variables) == set(['crds'])
+
+
+if __name__ == '__main__':
+    test_get_affected_variables()
+    test_are_paths_related()
+    test_get_changed_parameters()
+    test_get_used_parameters()
+    test_is_formula_changed()
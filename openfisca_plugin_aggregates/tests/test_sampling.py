@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+
+# OpenFisca -- A versatile microsimulation software
+# By: OpenFisca Team <contact@openfisca.fr>
+#
+# Copyright (C) 2011, 2012, 2013, 2014, 2015 OpenFisca Team
+# https://github.com/openfisca
+#
+# This file is part of OpenFisca.
+#
+# OpenFisca is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# OpenFisca is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy
+import pandas
+
+from openfisca_plugin_aggregates.sampling import (draw_stratified_sample, estimate_total, get_stratified_sample,
+    subsample_input_data_frame)
+
+
+def test_estimate_total(size = 20000, fraction = .1):
+    random_state = numpy.random.RandomState(0)
+    ids = numpy.arange(size)
+    weights = random_state.uniform(100, 1000, size)
+    values = random_state.exponential(1000, size) * (random_state.uniform(size = size) < .4)
+    sample = draw_stratified_sample(ids, weights, fraction)
+    assert (sample.sample_size >= 2).all()
+    expansion = (sample.population / sample.sample_size)[sample.strata]
+    total, standard_error = estimate_total(sample, values[sample.ids] * weights[sample.ids] * expansion)
+    assert standard_error > 0
+    assert abs(total - (values * weights).sum()) < 4 * standard_error
+
+
+def test_estimate_total_full_sample():
+    ids = numpy.arange(100)
+    weights = numpy.linspace(1, 2, 100)
+    sample = draw_stratified_sample(ids, weights, 1)
+    total, standard_error = estimate_total(sample, weights)
+    assert numpy.isclose(total, weights.sum())
+    assert standard_error == 0
+
+
+def test_get_stratified_sample():
+    ids = numpy.arange(100)
+    weights = numpy.linspace(1, 2, 100)
+    sample = get_stratified_sample(ids, weights, .2, sampling_unit = 'menages')
+    # The same survey is sampled once, whatever the legislation year it is simulated for
+    assert get_stratified_sample(ids.copy(), weights.copy(), .2, sampling_unit = 'menages') is sample
+    assert get_stratified_sample(ids, weights * 2, .2, sampling_unit = 'menages') is not sample
+    assert get_stratified_sample(ids, weights, .2, sampling_unit = 'familles') is not sample
+
+
+def test_subsample_input_data_frame():
+    input_data_frame = pandas.DataFrame(dict(
+        idmen = [0, 0, 1, 2, 2, 3],
+        idfoy = [0, 1, 2, 3, 3, 4],
+        wprm = [10., 10., 20., 30., 30., 40.],
+        ))
+    sample = draw_stratified_sample(numpy.arange(4), numpy.array([10., 20., 30., 40.]), .5, strata_count = 2)
+    data_frame = subsample_input_data_frame(input_data_frame, sample, 'idmen', id_columns = ['idfoy'],
+        weight_columns = ['wprm'])
+    assert sorted(set(data_frame.idmen)) == list(range(len(sample.ids)))
+    assert sorted(set(data_frame.idfoy)) == list(range(len(set(data_frame.idfoy))))
+    assert numpy.isclose(data_frame.groupby('idmen').wprm.first().sum(), 100)
+
+
+if __name__ == '__main__':
+    test_estimate_total()
+    test_estimate_total_full_sample()
+    test_get_stratified_sample()
+    test_subsample_input_data_frame()
@@ -55,6 +55,9 @@ setup(
     url = 'https://github.com/openfisca/openfisca-aggregates',
 
     entry_points = {
+        'console_scripts': [
+            'openfisca-aggregates = openfisca_plugin_aggregates.batch:main',
+            ],
         'openfisca.plugins': [
             'aggregates = openfisca_plugin_aggregates:register_plugin',
             ],